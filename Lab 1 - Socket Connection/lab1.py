@@ -7,57 +7,142 @@ Submission Date: 03rd October 2024
 import sys
 import pickle
 import socket
+import struct
+from concurrent.futures import ThreadPoolExecutor, wait
 
+MEMBER_TIMEOUT = 1.5  # seconds to wait on each group member
+DEFAULT_DEADLINE = 10.0  # seconds allowed for a whole concurrent probe run
+FRAME_HEADER = struct.Struct('!I')  # length prefix used by the framed wire mode
+MAX_FRAME_SZ = 16 * 1024 * 1024  # refuse anything bigger than this, as Lab 2's framing.py does
 
-def gcd_connection_task(hostname, port):
+
+def send_frame(sock, payload):
+    """
+    Send payload preceded by a 4-byte big-endian length header.
+    """
+    sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+
+def recv_into_exactly(sock, buffer):
+    """
+    Fill buffer completely from sock using recv_into on a memoryview (no copies).
+    Raises ConnectionError if the peer closes before buffer is filled.
+    """
+    view = memoryview(buffer)
+    while len(view):
+        received = sock.recv_into(view)
+        if received == 0:
+            raise ConnectionError("connection closed mid-frame")
+        view = view[received:]
+    return buffer
+
+
+def recv_frame(sock):
+    """
+    Explanation for the below recv_frame Code:
+    1. Read the 4-byte length header.
+    2. Refuse (ValueError) a length over MAX_FRAME_SZ, so a bad header cannot make us allocate gigabytes.
+    3. Preallocate a bytearray of exactly that length and fill it in place,
+        so large responses are never truncated and never concatenated chunk by chunk.
+    """
+    length, = FRAME_HEADER.unpack(recv_into_exactly(sock, bytearray(FRAME_HEADER.size)))
+    if length > MAX_FRAME_SZ:
+        raise ValueError('Frame of {} bytes exceeds limit'.format(length))
+    return recv_into_exactly(sock, bytearray(length))
+
+
+def gcd_connection_task(hostname, port, framed=False):
     """
     Explanation for the below gcd_connection_task Code:
     1. Use the socket library to use AF_INET type socket and SOCK_STREAM protocol
     2. Connect to the hostname and port provide as parameters provided.
     3. Send the request to the host and receive the response.
     4. Used pickle to load the data return by host and return it.
+    5. In framed mode the request and response carry a length header (see recv_frame).
     """
     print("Initiated Process of connecting to GCD: \n")
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as socket_details:
             socket_details.connect((hostname, port))
             print(f"BEGIN ({hostname}, {port} )")
-            socket_details.sendall(pickle.dumps('BEGIN'))
-            data = socket_details.recv(4096)
+            if framed:
+                send_frame(socket_details, pickle.dumps('BEGIN'))
+                data = recv_frame(socket_details)
+            else:
+                socket_details.sendall(pickle.dumps('BEGIN'))
+                data = socket_details.recv(4096)
             group_members = pickle.loads(data)
             print("Completed Process of Retreiving Data from GCD. \n")
             return group_members
         
-    except socket.error as exception:
+    except (socket.error, ValueError) as exception:
         print(f"Attempt to connect to GCD failed due to the exception: {exception}")
         sys.exit(1)
 
 
-def groupmember_connection_task(individual_member):
+def groupmember_connection_task(individual_member, log=print, framed=False, timeout=MEMBER_TIMEOUT):
     """
     Explanation for the below groupmember_connection_task Code:
     1. Similar to above function using socket library.
     2. Connecting with each host on the required port
     3. Once the connection has been establsihed send the HELLO request to it.
     4. Collect the response returned but it, print it and return it.
+    5. Output goes through log (print by default) so concurrent probes can buffer it.
+    6. In framed mode the HELLO and its response carry a length header.
+    7. Each socket operation waits at most timeout seconds.
     """
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as member_socket:
-            member_socket.settimeout(1.5)
+            member_socket.settimeout(timeout)
             member_socket.connect((individual_member['host'], individual_member['port']))
-            print(f"HELLO to {individual_member}")
-            member_socket.sendall(pickle.dumps('HELLO'))
-            response_data = member_socket.recv(4096)
+            log(f"HELLO to {individual_member}")
+            if framed:
+                send_frame(member_socket, pickle.dumps('HELLO'))
+                response_data = recv_frame(member_socket)
+            else:
+                member_socket.sendall(pickle.dumps('HELLO'))
+                response_data = member_socket.recv(4096)
             response = pickle.loads(response_data)
-            print(response)
+            log(response)
+            return response
             
     except socket.timeout:
-        print(f"Timeout occurred for group member {individual_member['host']}:{individual_member['port']}")
-        
-    except socket.error as exception:
-        print(f"HELLO to {individual_member}")
-        print(f"failed to connect: {{}} {exception}")
+        log(f"Timeout occurred for group member {individual_member['host']}:{individual_member['port']}")
         
+    except (socket.error, ValueError) as exception:
+        log(f"HELLO to {individual_member}")
+        log(f"failed to connect: {{}} {exception}")
+
+
+def concurrent_groupmember_task(group_members, max_workers, deadline=DEFAULT_DEADLINE, framed=False):
+    """
+    Explanation for the below concurrent_groupmember_task Code:
+    1. Submit groupmember_connection_task for every member to a pool of at most max_workers threads.
+    2. Each member writes its output into its own list instead of printing straight away.
+    3. Wait at most deadline seconds for the results, then drop any probes still queued.
+       Probes already running are not interrupted and the process waits for them before it exits,
+       so each socket operation gets at most the smaller of MEMBER_TIMEOUT and deadline.
+    4. Print every member's output in the order the GCD returned them, so runs are diffable.
+    5. A probe that raised an error of its own (say the reply could not be unpickled) prints it.
+    """
+    outputs = [[] for _ in group_members]
+    timeout = min(MEMBER_TIMEOUT, deadline)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = [executor.submit(groupmember_connection_task, member, output.append, framed, timeout)
+               for member, output in zip(group_members, outputs)]
+    done, _ = wait(futures, timeout=deadline)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    for member, future, output in zip(group_members, futures, outputs):
+        if future in done:
+            for line in output:
+                print(line)
+            if future.exception() is not None:
+                print(f"failed: {future.exception()!r}")
+        else:
+            print(f"HELLO to {member}")
+            print(f"No response within the {deadline}s deadline")
+
 
 
 def main():
@@ -67,20 +152,30 @@ def main():
     2. Hostname and port entered via terminal is stored and send to gcd_connection_task function.
     3. Check if null members are returned or not, if not then run a for loop and send each member to the 
         groupmember_connection_task function.
+    4. If a concurrency limit (and optionally a deadline in seconds) is given, probe the members
+        in parallel with concurrent_groupmember_task instead.
+    5. The --framed flag switches every exchange to the length-prefixed wire mode.
     """
-    if len(sys.argv) != 3:
-        print("Please use the following pattern of command: python lab1.py <hostname> <port>")
+    framed = '--framed' in sys.argv
+    args = [arg for arg in sys.argv if arg != '--framed']
+    if len(args) not in (3, 4, 5):
+        print("Please use the following pattern of command: python lab1.py <hostname> <port> [concurrency] [deadline] [--framed]")
         sys.exit(1)
         
-    gcd_hostname = sys.argv[1]
-    gcd_port = int(sys.argv[2])
-    all_group_members = gcd_connection_task(gcd_hostname, gcd_port)
+    gcd_hostname = args[1]
+    gcd_port = int(args[2])
+    concurrency = int(args[3]) if len(args) > 3 else None
+    deadline = float(args[4]) if len(args) > 4 else DEFAULT_DEADLINE
+    all_group_members = gcd_connection_task(gcd_hostname, gcd_port, framed)
     
 
     if all_group_members:
         print("Initiated sending message to each host: \n")
-        for each_member in all_group_members:
-            groupmember_connection_task(each_member) 
+        if concurrency:
+            concurrent_groupmember_task(all_group_members, concurrency, deadline, framed)
+        else:
+            for each_member in all_group_members:
+                groupmember_connection_task(each_member, framed=framed) 
         print("Received all messages sent back from GCD. \n")
     else:
         print("Group members were not found.")
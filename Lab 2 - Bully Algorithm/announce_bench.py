@@ -0,0 +1,72 @@
+"""
+Benchmark for announcing a new leader to the bully group.
+
+Starts N nodes in this process (see election_sim.py) and repeatedly crashes
+the leader and has the highest survivor take over. Its election finds no live
+higher member at once, so the time until every node agrees on it is mostly
+the time it takes to announce the victory. Each group size is run with the
+serial COORDINATOR broadcast and with tree announcements (lab2.ANNOUNCE_FANOUT
+subtrees per hop), and the median convergence time and messages per takeover
+are printed for both.
+
+On loopback a send costs next to nothing, so every message is delayed by
+DELAY_MS first, as a hop across a real network would be.
+
+Usage: python announce_bench.py [ROUNDS] [DELAY_MS] [N ...]
+       ROUNDS defaults to 5, DELAY_MS to 2, N to 10 50 100
+"""
+import statistics
+import sys
+import threading
+import time
+
+import lab2
+from election_sim import messages_sent, start_group, stop_group, wait_for_leader
+
+
+def delay_links(nodes, seconds):
+    """Make every message the nodes send take seconds longer."""
+    for node in nodes:
+        def delayed(address, message, timeout=None, send=node.send_message):
+            time.sleep(seconds)
+            return send(address, message, timeout)
+        node.send_message = delayed
+
+
+def run(n, announce_fanout, rounds, delay):
+    """
+    Take n nodes through rounds leader takeovers.
+    :return: (median seconds to converge, median messages per takeover, takeovers that timed out)
+    """
+    baseline_threads = threading.active_count()
+    gcd, nodes = start_group(n, announce_fanout=announce_fanout, monitor_leader=False)
+    delay_links(nodes, delay)
+    live = sorted(nodes, key=lambda node: node.unique_id)
+    seconds, messages, timeouts = [], [], 0
+    try:
+        live[-1].request_election()
+        wait_for_leader(live, live[-1].unique_id)
+        for _ in range(rounds):
+            live.pop().stop()
+            before = messages_sent(live)
+            live[-1].request_election()
+            converged = wait_for_leader(live, live[-1].unique_id)
+            if converged is None:
+                timeouts += 1
+            else:
+                seconds.append(converged)
+            messages.append(messages_sent(live) - before)
+    finally:
+        stop_group(gcd, nodes, baseline_threads)
+    return (statistics.median(seconds) if seconds else None), statistics.median(messages), timeouts
+
+
+if __name__ == '__main__':
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    delay = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.002
+    sizes = [int(arg) for arg in sys.argv[3:]] or [10, 50, 100]
+    for n in sizes:
+        for label, fanout in (('serial', None), ('tree x{}'.format(lab2.ANNOUNCE_FANOUT), lab2.ANNOUNCE_FANOUT)):
+            median, msgs, timeouts = run(n, fanout, rounds, delay)
+            print('{:>5} nodes  {:<10} {:>9} ms  {:>6.0f} msgs  {} timeouts'.format(
+                n, label, 'timeout' if median is None else '{:.1f}'.format(median * 1000), msgs, timeouts))
@@ -0,0 +1,153 @@
+"""
+Compact binary encoding for the bully group's messages.
+
+A binary message is a 1-byte message type followed by a fixed layout for that
+type, with every process id (days_to_birthday, su_id) packed as a 2-byte and a
+4-byte unsigned integer. An ELECTION carries the membership as a table of the
+distinct hosts followed by 9 bytes per member, instead of a pickled dict.
+
+Message types are small numbers while every pickle starts with the PROTO opcode
+(0x80), so decode() accepts either and a receiver does not need to know which
+one the sender chose. encode() falls back to pickle for anything it has no
+layout for (GCD responses, METRICS, ANNOUNCE, error strings...).
+
+>>> decode(encode(('ELECTION', {(5, 1000001): ('127.0.0.1', 4000), (9, 1000002): ('127.0.0.1', 4001)})))
+('ELECTION', {(5, 1000001): ('127.0.0.1', 4000), (9, 1000002): ('127.0.0.1', 4001)})
+>>> encode('OK'), decode(b'\\x04')
+(b'\\x04', 'OK')
+>>> decode(encode(('BEGIN', ((5, 1000001), ('localhost', 4000), 7))))
+('BEGIN', ((5, 1000001), ('localhost', 4000), 7))
+>>> decode(encode(('BEGIN', ((5, 1000001), ('localhost', 4000)))))  # no version: pickled
+('BEGIN', ((5, 1000001), ('localhost', 4000)))
+"""
+import pickle
+import struct
+from functools import lru_cache
+
+BEGIN, HEARTBEAT, ELECTION, OK, ACK, COORDINATOR, PROBE = range(1, 8)  # message types
+
+PID = struct.Struct('!BHI')  # type, days_to_birthday, su_id (COORDINATOR)
+HEARTBEAT_LAYOUT = struct.Struct('!BHIQ')  # type, pid, last membership version
+BEGIN_LAYOUT = struct.Struct('!BHIQHB')  # type, pid, last membership version, port, host length; host follows
+ELECTION_LAYOUT = struct.Struct('!BIB')  # type, members, hosts; host table and members follow
+HOST = struct.Struct('!B')  # host length; host follows
+MEMBER = struct.Struct('!HIBH')  # days_to_birthday, su_id, index into the host table, port
+
+REPLIES = {'OK': bytes([OK]), 'ACK': bytes([ACK])}
+
+
+def is_binary(payload) -> bool:
+    """
+    Tell whether payload was written by encode() rather than pickle.
+
+    >>> is_binary(encode(('PROBE', None))), is_binary(pickle.dumps(('PROBE', None)))
+    (True, False)
+    """
+    return len(payload) > 0 and payload[0] in DECODERS
+
+
+def encode(message) -> bytes:
+    """
+    Encode a message tuple or an 'OK'/'ACK' reply, in the binary layout where there is one.
+
+    :return: the payload, pickled if message has no binary layout
+    """
+    try:
+        if isinstance(message, str):
+            return REPLIES[message]
+        name, data = message
+        if name == 'ELECTION':
+            return encode_election(data)
+        if name == 'COORDINATOR':
+            return PID.pack(COORDINATOR, *data)
+        if name == 'PROBE' and data is None:
+            return bytes([PROBE])
+        if name == 'HEARTBEAT':
+            (days, su_id), version = data
+            return HEARTBEAT_LAYOUT.pack(HEARTBEAT, days, su_id, version)
+        if name == 'BEGIN':
+            (days, su_id), (host, port), version = data
+            host = host.encode()
+            return BEGIN_LAYOUT.pack(BEGIN, days, su_id, version, port, len(host)) + host
+    except (KeyError, ValueError, TypeError, AttributeError, struct.error):
+        pass  # not a shape we have a layout for
+    return pickle.dumps(message)
+
+
+@lru_cache(maxsize=64)
+def member_table(count):
+    """Struct for count MEMBERs back to back, so a whole table packs and unpacks in one call."""
+    return struct.Struct('!' + MEMBER.format[1:] * count)
+
+
+def encode_election(members):
+    hosts = {}
+    flat = []
+    for (days, su_id), (host, port) in members.items():
+        flat += (days, su_id, hosts.setdefault(host, len(hosts)), port)
+    parts = [ELECTION_LAYOUT.pack(ELECTION, len(members), len(hosts))]
+    for host in hosts:
+        host = host.encode()
+        parts += [HOST.pack(len(host)), host]
+    parts.append(member_table(len(members)).pack(*flat))
+    return b''.join(parts)
+
+
+def decode(payload):
+    """
+    Decode a payload written by encode() or by pickle.dumps.
+
+    :raises ValueError: if a binary payload is truncated
+    """
+    decoder = DECODERS.get(payload[0]) if len(payload) else None
+    if decoder is None:
+        return pickle.loads(payload)
+    try:
+        return decoder(payload)
+    except (struct.error, IndexError) as err:
+        raise ValueError('Truncated message: {}'.format(err))
+
+
+def decode_begin(payload):
+    _, days, su_id, version, port, length = BEGIN_LAYOUT.unpack_from(payload)
+    start = BEGIN_LAYOUT.size
+    if len(payload) != start + length:
+        raise IndexError('expected a {} byte host'.format(length))
+    return 'BEGIN', ((days, su_id), (payload[start:].decode(), port), version)
+
+
+def decode_heartbeat(payload):
+    _, days, su_id, version = HEARTBEAT_LAYOUT.unpack(payload)
+    return 'HEARTBEAT', ((days, su_id), version)
+
+
+def decode_election(payload):
+    _, count, host_count = ELECTION_LAYOUT.unpack_from(payload)
+    offset = ELECTION_LAYOUT.size
+    hosts = []
+    for _ in range(host_count):
+        length, = HOST.unpack_from(payload, offset)
+        offset += HOST.size
+        hosts.append(payload[offset:offset + length].decode())
+        offset += length
+    table = member_table(count)
+    if len(payload) != offset + table.size:
+        raise IndexError('expected {} members'.format(count))
+    fields = iter(table.unpack_from(payload, offset))
+    return 'ELECTION', {(days, su_id): (hosts[host], port) for days, su_id, host, port in zip(fields, fields, fields, fields)}
+
+
+def decode_coordinator(payload):
+    _, days, su_id = PID.unpack(payload)
+    return 'COORDINATOR', (days, su_id)
+
+
+DECODERS = {
+    BEGIN: decode_begin,
+    HEARTBEAT: decode_heartbeat,
+    ELECTION: decode_election,
+    OK: lambda payload: 'OK',
+    ACK: lambda payload: 'ACK',
+    COORDINATOR: decode_coordinator,
+    PROBE: lambda payload: ('PROBE', None),
+}
@@ -0,0 +1,57 @@
+"""
+Microbenchmark of codec.py against pickle.
+
+Encodes and decodes each bully message type many times with both, and prints
+messages per second and the size on the wire. ELECTION is measured with the
+membership of groups of several sizes, since it carries the whole group.
+
+Usage: python codec_bench.py [SECONDS_PER_CASE]
+"""
+import pickle
+import sys
+import time
+
+import codec
+
+
+def members(n):
+    return {(1 + i % 365, 1_000_000 + i): ('127.0.0.1', 10_000 + i) for i in range(n)}
+
+
+def rate(fn, arg, seconds):
+    """Calls of fn(arg) per second, over about seconds."""
+    calls = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while True:
+        for _ in range(100):
+            fn(arg)
+        calls += 100
+        now = time.perf_counter()
+        if now >= deadline:
+            return calls / (now - started)
+
+
+CASES = [
+    ('BEGIN', ('BEGIN', ((5, 1000001), ('localhost', 40000), 17))),
+    ('HEARTBEAT', ('HEARTBEAT', ((5, 1000001), 17))),
+    ('COORDINATOR', ('COORDINATOR', (365, 1000042))),
+    ('PROBE', ('PROBE', None)),
+    ('OK', 'OK'),
+    ('ELECTION x10', ('ELECTION', members(10))),
+    ('ELECTION x100', ('ELECTION', members(100))),
+    ('ELECTION x1000', ('ELECTION', members(1000))),
+]
+
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+    print('{:<15} {:>6} {:>12} {:>12}   {:>6} {:>12} {:>12}'.format(
+        'message', 'pickle', 'encode/s', 'decode/s', 'binary', 'encode/s', 'decode/s'))
+    for label, message in CASES:
+        pickled, binary = pickle.dumps(message), codec.encode(message)
+        assert codec.decode(binary) == message
+        print('{:<15} {:>6} {:>12,.0f} {:>12,.0f}   {:>6} {:>12,.0f} {:>12,.0f}'.format(
+            label,
+            len(pickled), rate(pickle.dumps, message, seconds), rate(pickle.loads, pickled, seconds),
+            len(binary), rate(codec.encode, message, seconds), rate(codec.decode, binary, seconds)))
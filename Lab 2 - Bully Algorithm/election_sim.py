@@ -0,0 +1,156 @@
+"""
+In-process simulation harness for the bully algorithm.
+
+Starts a GCD on loopback and N BullyNodes inside this one process. Once all
+of them have joined, the lowest node (the bully algorithm's worst case) holds
+the first election; then the leader is crashed and the lowest node holds the
+next one. For both elections it reports the time until every live node agrees
+on the expected leader, the messages sent and the peak number of threads in
+the process. A phase that does not converge within CONVERGE_TIMEOUT is
+reported as a timeout.
+
+Usage: python election_sim.py [N ...] [--detect] [--binary]
+       N defaults to 10 50 100; --detect leaves finding the crash to the
+       nodes' failure detectors instead of starting the election directly;
+       --binary has the nodes send codec.py's binary messages instead of pickles
+"""
+import random
+import sys
+import threading
+import time
+
+import gcd2
+from lab2 import BullyNode
+
+CONVERGE_TIMEOUT = 120.0  # seconds to wait for the group to agree on a leader
+SETTLE_TIMEOUT = 30.0  # seconds to wait for a stopped group's leftover threads to finish
+
+
+class ThreadSampler(object):
+    """Samples threading.active_count() in the background and keeps the peak."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+
+
+def wait_for_leader(nodes, expected, timeout=CONVERGE_TIMEOUT):
+    """
+    Wait until every node in nodes has expected as its leader.
+    :return: seconds waited, or None on timeout
+    """
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if all(node.leader == expected and not node.election_in_progress for node in nodes):
+            return time.perf_counter() - started
+        time.sleep(0.005)
+    return None
+
+
+def messages_sent(nodes):
+    return sum(node.messages_sent for node in nodes)
+
+
+def measure_election(nodes, starters):
+    """
+    Have the lowest of starters start an election (none if starters is empty)
+    and measure how nodes converge on the highest of them.
+    :return: {'seconds': time to converge or None, 'messages': sent by nodes, 'peak_threads': in this process}
+    """
+    before = messages_sent(nodes)
+    with ThreadSampler() as sampler:
+        if starters:
+            lowest = min(starters, key=lambda node: node.unique_id)
+            lowest.request_election()
+        converged = wait_for_leader(nodes, max(node.unique_id for node in nodes))
+    return {'seconds': converged, 'messages': messages_sent(nodes) - before, 'peak_threads': sampler.peak}
+
+
+def start_group(n, seed=5520, **node_options):
+    """
+    Start a GCD and n nodes that all know the full membership, with no leader yet.
+    :param node_options: passed on to every BullyNode; framed defaults to True, the GCD being gcd2.py,
+                         and pooled to True, every peer being a BullyNode
+    :return: (gcd server, nodes)
+    """
+    node_options.setdefault('framed', True)
+    node_options.setdefault('pooled', True)
+    rng = random.Random(seed)
+    gcd2.GroupCoordinatorDaemon.reset()
+    gcd = gcd2.make_server(0, workers=16)
+    threading.Thread(target=gcd.serve_forever, daemon=True).start()
+    gcd_address = ('localhost', gcd.server_address[1])
+
+    pids = [(rng.randint(1, 365), 1_000_000 + i) for i in range(n)]
+    nodes = [BullyNode(gcd_address, pid, heartbeat_interval=None, verbose=False, **node_options) for pid in pids]
+    for node in nodes:
+        node.start(elect=False)
+    # let everyone learn the full membership, as a round of GCD heartbeats would
+    for node in nodes:
+        node.send_heartbeat()
+    return gcd, nodes
+
+
+def stop_group(gcd, nodes, baseline_threads):
+    """Stop every node still running and the GCD, and wait for their threads to wind down."""
+    for node in nodes:
+        if not node.stop_event.is_set():
+            node.stop()
+    gcd.shutdown()
+    gcd.server_close()
+    # elections already under way run on after stop(); let them drain before the next group
+    settle_until = time.perf_counter() + SETTLE_TIMEOUT
+    while threading.active_count() > baseline_threads and time.perf_counter() < settle_until:
+        time.sleep(0.05)
+
+
+def simulate(n, detect=False, seed=5520, binary=False):
+    """
+    Run one group of n nodes through a first election and a leader crash.
+    :return: dict of measurements for both phases
+    """
+    baseline_threads = threading.active_count()
+    gcd, nodes = start_group(n, seed, monitor_leader=detect, binary=binary)
+    results = {'nodes': n}
+    try:
+        # first election, started by the lowest node
+        results['elect'] = measure_election(nodes, nodes)
+
+        # the leader crashes and the lowest node (or, with detect, whoever notices first) starts over
+        leader = max(nodes, key=lambda node: node.unique_id)
+        survivors = [node for node in nodes if node is not leader]
+        leader.stop()
+        results['crash'] = measure_election(survivors, [] if detect else survivors)
+    finally:
+        stop_group(gcd, nodes, baseline_threads)
+    return results
+
+
+if __name__ == '__main__':
+    detect = '--detect' in sys.argv
+    binary = '--binary' in sys.argv
+    sizes = [int(arg) for arg in sys.argv[1:] if arg not in ('--detect', '--binary')] or [10, 50, 100]
+    print('{:>5}  {:>22}  {:>22}'.format('nodes', 'first election', 'after leader crash'))
+    print('{:>5}  {:>8} {:>7} {:>5}  {:>8} {:>7} {:>5}'.format('', 'seconds', 'msgs', 'thr', 'seconds', 'msgs', 'thr'))
+    for n in sizes:
+        results = simulate(n, detect, binary=binary)
+        row = [n]
+        for phase in ('elect', 'crash'):
+            seconds = results[phase]['seconds']
+            row += ['timeout' if seconds is None else '{:.3f}'.format(seconds),
+                    results[phase]['messages'], results[phase]['peak_threads']]
+        print('{:>5}  {:>8} {:>7} {:>5}  {:>8} {:>7} {:>5}'.format(*row))
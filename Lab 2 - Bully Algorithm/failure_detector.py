@@ -0,0 +1,189 @@
+"""
+Failure detection for the bully group.
+
+PhiAccrualDetector turns the arrival times of a peer's replies into a
+suspicion level phi (Hayashibara et al., "The phi accrual failure detector"):
+phi = -log10(probability that the next reply is still on its way), using a
+normal distribution fitted to the recent gaps between replies. A phi of 8
+means the silence so far would happen about once in 10^8 healthy gaps.
+
+LeaderMonitor PROBEs the current leader on a jittered schedule, feeds the
+replies into a PhiAccrualDetector and calls back once phi (or a plain silence
+timeout) says the leader is gone.
+"""
+import math
+import random
+import threading
+import time
+from collections import deque
+
+PHI_THRESHOLD = 8.0  # suspect the leader once phi reaches this
+PROBE_INTERVAL = 1.0  # seconds between PROBEs to a healthy leader
+PROBE_JITTER = 0.2  # each interval is scaled by a random factor in [1 - jitter, 1 + jitter]
+MIN_PROBE_INTERVAL = 0.25  # fastest we PROBE a leader that has started missing replies
+MAX_SILENCE = 10.0  # seconds without a reply after which we suspect regardless of phi
+HISTORY_SZ = 100  # reply gaps remembered by the detector
+MIN_STD_DEV = 0.1  # seconds, keeps a perfectly regular history from making phi explode
+
+
+class PhiAccrualDetector(object):
+    """
+    Suspicion level for one peer, from the gaps between its replies.
+
+    >>> detector = PhiAccrualDetector()
+    >>> for t in range(10):  # a reply every second
+    ...     detector.heartbeat(float(t))
+    >>> round(detector.phi(9.5), 2)  # half a second after the last reply: nothing unusual
+    0.0
+    >>> round(detector.phi(10.2), 2)  # a little late
+    1.64
+    >>> detector.phi(12.0) > PHI_THRESHOLD  # three seconds of silence
+    True
+    """
+
+    def __init__(self, history=HISTORY_SZ, min_std_dev=MIN_STD_DEV):
+        self.gaps = deque(maxlen=history)
+        self.min_std_dev = min_std_dev
+        self.last_heartbeat = None
+
+    def heartbeat(self, now):
+        """Record a reply arriving at time now."""
+        if self.last_heartbeat is not None:
+            self.gaps.append(now - self.last_heartbeat)
+        self.last_heartbeat = now
+
+    def phi(self, now):
+        """Suspicion level at time now; 0.0 until we have seen two replies."""
+        if not self.gaps:
+            return 0.0
+        mean = sum(self.gaps) / len(self.gaps)
+        variance = sum((gap - mean) ** 2 for gap in self.gaps) / len(self.gaps)
+        std_dev = max(math.sqrt(variance), self.min_std_dev)
+        elapsed = now - self.last_heartbeat
+        # P(gap > elapsed) for a normal distribution of gaps
+        p_later = 0.5 * math.erfc((elapsed - mean) / (std_dev * math.sqrt(2)))
+        return -math.log10(max(p_later, 1e-300))
+
+    def silence(self, now):
+        """Seconds since the last reply (0.0 if there has been none)."""
+        return 0.0 if self.last_heartbeat is None else now - self.last_heartbeat
+
+    def reset(self):
+        self.gaps.clear()
+        self.last_heartbeat = None
+
+
+class LeaderMonitor(object):
+    """
+    PROBEs the leader and starts an election when it stops answering.
+
+    The probe interval is jittered so the group does not PROBE in lockstep,
+    and shrinks (down to MIN_PROBE_INTERVAL) while the leader is missing
+    replies, so a crash is confirmed sooner.
+
+    A suspicion is counted as a false positive when the leader we gave up on
+    turns out to still be leader and answers a PROBE afterwards. Detection
+    latency is the time from the leader's last reply to our suspicion.
+    """
+
+    def __init__(self, get_leader, probe, on_failure, interval=PROBE_INTERVAL, jitter=PROBE_JITTER,
+                 threshold=PHI_THRESHOLD, max_silence=MAX_SILENCE):
+        """
+        :param get_leader: returns the pid of the leader to watch, or None when there is nothing to watch
+                           (no leader yet, we are the leader, or an election is running)
+        :param probe: probe(leader) sends a PROBE and returns True if the leader answered OK
+        :param on_failure: on_failure(leader) is called once per suspected leader
+        """
+        self.get_leader = get_leader
+        self.probe = probe
+        self.on_failure = on_failure
+        self.interval = interval
+        self.jitter = jitter
+        self.threshold = threshold
+        self.max_silence = max_silence
+        self.detector = PhiAccrualDetector()
+        self.watching = None  # leader the detector's history belongs to
+        self.suspected = None  # leader we last declared failed
+        self.lock = threading.Lock()
+        self.probes = 0
+        self.probe_failures = 0
+        self.suspicions = 0
+        self.false_positives = 0
+        self.detection_latencies = []
+        self.stop_event = threading.Event()
+
+    def next_interval(self, missed):
+        """Seconds to wait before the next PROBE, halved for each reply missed in a row."""
+        interval = max(MIN_PROBE_INTERVAL, self.interval / (2 ** missed))
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def check(self, now=None):
+        """
+        PROBE the leader once and update the suspicion.
+        The history starts over whenever there was no leader to watch since the last PROBE (an
+        election ran), even if the election re-confirmed the same leader, so its gap is not
+        counted as silence.
+
+        >>> leaders = [(5, 1), None, (5, 1)]  # the election in between re-confirms (5, 1)
+        >>> monitor = LeaderMonitor(lambda: leaders.pop(0), lambda leader: False, print)
+        >>> monitor.check(now=0.0), monitor.check(now=1.0), monitor.check(now=30.0)
+        (False, None, False)
+        >>> monitor.suspicions
+        0
+
+        :return: True if the leader answered, False if it did not, None if there was no one to PROBE
+        """
+        leader = self.get_leader()
+        if leader is None:
+            self.watching = None  # whoever leads after this starts with a fresh history
+            return None
+        if leader != self.watching:
+            self.watching = leader
+            self.detector.reset()
+        answered = self.probe(leader)
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.probes += 1
+            if answered:
+                if self.suspected == leader:
+                    self.false_positives += 1
+                self.suspected = None
+                self.detector.heartbeat(now)
+                return True
+            self.probe_failures += 1
+            if self.detector.last_heartbeat is None:
+                self.detector.heartbeat(now)  # never heard from it, start the silence clock here
+            if self.suspected == leader:
+                return False
+            if self.detector.phi(now) < self.threshold and self.detector.silence(now) < self.max_silence:
+                return False
+            self.suspected = leader
+            self.suspicions += 1
+            self.detection_latencies.append(self.detector.silence(now))
+        self.on_failure(leader)
+        return False
+
+    def run(self):
+        """PROBE until stop() is called; meant for a daemon thread."""
+        missed = 0
+        while not self.stop_event.wait(self.next_interval(missed)):
+            try:
+                missed = min(missed + 1, 8) if self.check() is False else 0
+            except Exception as e:
+                print(f"Failure detector error: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+
+    def metrics(self):
+        """Counters and detection latency (seconds) since this monitor started."""
+        with self.lock:
+            latencies = sorted(self.detection_latencies)
+            return {
+                'probes': self.probes,
+                'probe_failures': self.probe_failures,
+                'suspicions': self.suspicions,
+                'false_positives': self.false_positives,
+                'detection_latency_mean': sum(latencies) / len(latencies) if latencies else None,
+                'detection_latency_max': latencies[-1] if latencies else None,
+            }
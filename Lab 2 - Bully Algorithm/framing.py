@@ -0,0 +1,68 @@
+"""
+Length-prefixed framing for messages exchanged with the Group Coordinator Daemon.
+
+A framed message is a 4-byte big-endian length header followed by exactly that
+many bytes of payload. Every pickle sent by group members starts with the PROTO
+opcode (0x80) while any header for a payload under 16 MiB starts with 0x00, so a
+server can tell a framed request from a legacy single-recv one by its first byte.
+"""
+import struct
+
+HEADER = struct.Struct('!I')  # payload length, network byte order
+MAX_FRAME_SZ = 16 * 1024 * 1024  # refuse anything bigger than this
+
+
+def is_framed(first_byte: bytes) -> bool:
+    """
+    Tell whether a request starting with first_byte is framed.
+
+    >>> is_framed(HEADER.pack(4096)[:1])
+    True
+    >>> import pickle
+    >>> is_framed(pickle.dumps('BEGIN')[:1])
+    False
+    """
+    return first_byte == b'\x00'
+
+
+def send_frame(sock, payload: bytes):
+    """
+    Send payload preceded by its length header.
+
+    :param sock: connected stream socket
+    :param payload: bytes to send
+    """
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def recv_into_exactly(sock, view: memoryview):
+    """
+    Fill view completely from sock, without allocating intermediate buffers.
+
+    :raises ConnectionError: if the peer closes before view is filled
+    """
+    while len(view):
+        n = sock.recv_into(view)
+        if n == 0:
+            raise ConnectionError('connection closed mid-frame')
+        view = view[n:]
+
+
+def recv_frame(sock) -> bytearray:
+    """
+    Receive one framed message. The payload is read straight into a buffer
+    preallocated to the advertised length, so a large membership list arrives
+    without any repeated concatenation.
+
+    :param sock: connected stream socket
+    :return: the payload
+    :raises ValueError: if the advertised length is larger than MAX_FRAME_SZ
+    """
+    header = bytearray(HEADER.size)
+    recv_into_exactly(sock, memoryview(header))
+    length, = HEADER.unpack(header)
+    if length > MAX_FRAME_SZ:
+        raise ValueError('Frame of {} bytes exceeds limit'.format(length))
+    payload = bytearray(length)
+    recv_into_exactly(sock, memoryview(payload))
+    return payload
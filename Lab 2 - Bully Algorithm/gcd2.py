@@ -1,44 +1,265 @@
+import heapq
 import pickle
+import random
 import socket
 import socketserver
 import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+import codec
+import framing
 
 BUF_SZ = 1024 # tcp receive buffer size
+CLIENT_TIMEOUT = 5.0 # seconds a client may stall before we give up on it
+RESOLVER_CACHE_SZ = 256 # host names remembered by the resolver cache
+RESOLVER_TTL = 300.0 # seconds a resolved host name stays cached
+MEMBERSHIP_LOG_SZ = 1024 # membership changes remembered for delta responses
+LEASE_TIME = 60.0 # seconds a member stays listed without a BEGIN or HEARTBEAT
+EPOCH_SHIFT = 32 # membership versions are epoch << EPOCH_SHIFT plus a count of changes
+
+
+def new_epoch():
+    """
+    A random starting membership version for a GCD instance. A version a client
+    got from another instance (one before a restart or reset()) then falls outside
+    this instance's range, and is answered with a SNAPSHOT rather than a DELTA
+    against a history it never saw.
+    """
+    return random.randrange(1, 1 << 31) << EPOCH_SHIFT
+
+
+class ResolverCache(object):
+    """
+    LRU cache in front of socket.gethostbyname. Entries expire after ttl
+    seconds, and at most max_entries host names are kept. Failed lookups are
+    not cached.
+
+    >>> lookups = []
+    >>> cache = ResolverCache(max_entries=2, resolve=lambda host: lookups.append(host) or '127.0.0.1')
+    >>> [cache.gethostbyname(host) for host in ('localhost', 'localhost', 'a', 'b', 'localhost')]
+    ['127.0.0.1', '127.0.0.1', '127.0.0.1', '127.0.0.1', '127.0.0.1']
+    >>> lookups  # 'localhost' was the least recently used when 'b' came in
+    ['localhost', 'a', 'b', 'localhost']
+    >>> cache.stats()
+    {'hits': 1, 'misses': 4, 'entries': 2}
+    """
+
+    def __init__(self, max_entries=RESOLVER_CACHE_SZ, ttl=RESOLVER_TTL, resolve=socket.gethostbyname):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.resolve = resolve
+        self.entries = OrderedDict() # (ip, expiry time) indexed by host name, least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def gethostbyname(self, host):
+        """
+        Resolve host, answering from the cache when we can.
+
+        :raises OSError: whatever the resolver raises for an unknown host
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(host)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(host)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        ip = self.resolve(host) # outside the lock, this is the slow part
+        with self.lock:
+            self.entries[host] = (ip, now + self.ttl)
+            self.entries.move_to_end(host)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return ip
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+
 class GroupCoordinatorDaemon(socketserver.BaseRequestHandler):
     """
 A Group Coordinator Daemon (GCD) which will respond with a list of potential
 group members to a text message BEGIN
 with list of group members to contact.
-We respond with a dictionary of group members.
+We respond with a dictionary of group members, or, when the BEGIN carries the
+last membership version the client saw, with only what changed since then.
+Each member holds a lease of lease_time seconds, renewed by a BEGIN or a
+lightweight HEARTBEAT; members whose lease runs out are evicted.
+A STATS message is answered with a dictionary of GCD counters.
 """
 # global group data structures
     listeners_by_pid = {} # listener address indexed by process id (as returned from BEGIN message)
     pids_by_listener = {} # process ids indexed by listener address (only one pid for each unique (host, port))
     pids_by_student = {} # process ids indexed by student id (each student only allowed one at a time)
+    membership_version = new_epoch() # bumped on every change to listeners_by_pid
+    membership_log = deque(maxlen=MEMBERSHIP_LOG_SZ) # (version, pid, listener or None when removed), oldest first
+    lease_time = LEASE_TIME
+    lease_expiry = {} # lease expiry time (time.monotonic) indexed by process id
+    lease_heap = [] # (expiry time, pid) min-heap, stale entries are skipped when popped
+    evictions = 0 # members evicted because their lease ran out
+    lock = threading.Lock() # guards the group data structures above when serving concurrently
     # we want to restrict all listeners to be on the same host as the GCD
     localhost_ip = socket.gethostbyname('localhost')
+    resolver = ResolverCache() # listener host names seen in BEGIN messages
     
     def handle(self):
         """
-        Handles the incoming messages - expects only 'BEGIN' messages
+        Handles the incoming messages - expects 'BEGIN', 'HEARTBEAT' or 'STATS' messages
         """
         #print(self.request.getsockname())
-        raw = self.request.recv(BUF_SZ) # self.request is the TCP socket connected to the client
+        self.request.settimeout(CLIENT_TIMEOUT)
+        # self.request is the TCP socket connected to the client
+        # a length-prefixed request gets a length-prefixed response (see framing.py),
+        # and a binary request a binary response where there is a layout for it (see codec.py)
+        framed = framing.is_framed(self.request.recv(1, socket.MSG_PEEK))
+        raw = b''
         try:
-            message = pickle.loads(raw)
+            raw = framing.recv_frame(self.request) if framed else self.request.recv(BUF_SZ)
+            message = codec.decode(raw)
         except Exception:
-            response = bytes('Expected a pickled message, got ' + str(raw)[:100] +'\n', 'utf-8')
+            response_data = 'Expected a pickled message, got ' + str(raw)[:100] + '\n'
         else:
             try:
-                response_data = self.handle_join(message)
+                response_data = self.handle_message(message)
             except ValueError as err:
                 response_data = str(err)
-        response = pickle.dumps(response_data)
-        self.request.sendall(response)
-        self.request.shutdown(socket.SHUT_RDWR)
+        response = codec.encode(response_data) if codec.is_binary(raw) else pickle.dumps(response_data)
+        if framed:
+            framing.send_frame(self.request, response)
+        else:
+            self.request.sendall(response)
+        try:
+            self.request.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass # client already hung up
         self.request.close()
     @staticmethod
-    
+    def handle_message(message):
+        """
+        Route a message to its handler by name.
+        :param message: ('BEGIN', ...), ('HEARTBEAT', ...) or ('STATS', None)
+        :return: the response data for the client
+        :raises ValueError: if the message cannot be validated
+        """
+        try:
+            message_name, message_data = message
+        except (ValueError, TypeError):
+            raise ValueError('Malformed message')
+        if message_name == 'STATS':
+            return GroupCoordinatorDaemon.stats()
+        if message_name == 'HEARTBEAT':
+            return GroupCoordinatorDaemon.handle_heartbeat(message_data)
+        return GroupCoordinatorDaemon.handle_join(message)
+
+    @staticmethod
+    def handle_heartbeat(message_data):
+        """
+        Renew the lease of an existing member.
+        :param message_data: ((days_to_bd, su_id), last_version)
+        :return: membership_since(last_version), so members also learn of evictions
+        :raises ValueError: if malformed, or if the member is not (or no longer) in the group
+        """
+        try:
+            process_id, last_version = message_data
+        except (ValueError, TypeError):
+            raise ValueError('Malformed heartbeat, expected ((days_to_bd,su_id), last_version)')
+        if not (type(last_version) is int and last_version >= 0):
+            raise ValueError('Malformed membership version, expected a non-negative int')
+        with GroupCoordinatorDaemon.lock:
+            GroupCoordinatorDaemon.evict_expired()
+            if process_id not in GroupCoordinatorDaemon.listeners_by_pid:
+                raise ValueError('Unknown member {}, send BEGIN to join'.format(process_id))
+            GroupCoordinatorDaemon.renew_lease(process_id)
+            return GroupCoordinatorDaemon.membership_since(last_version)
+
+    @staticmethod
+    def renew_lease(process_id, now=None):
+        """
+        Push process_id's lease lease_time seconds into the future. Caller must hold the lock.
+        """
+        expiry = (time.monotonic() if now is None else now) + GroupCoordinatorDaemon.lease_time
+        GroupCoordinatorDaemon.lease_expiry[process_id] = expiry
+        heapq.heappush(GroupCoordinatorDaemon.lease_heap, (expiry, process_id))
+
+    @staticmethod
+    def evict_expired(now=None):
+        """
+        Remove every member whose lease has run out. Caller must hold the lock.
+        Only heap entries that are due are looked at; entries left behind by a
+        renewal or by a member that already left are dropped as they surface.
+        :return: number of members evicted
+        """
+        now = time.monotonic() if now is None else now
+        heap = GroupCoordinatorDaemon.lease_heap
+        expiry_by_pid = GroupCoordinatorDaemon.lease_expiry
+        group = GroupCoordinatorDaemon.listeners_by_pid
+        evicted = 0
+        while heap and heap[0][0] <= now:
+            expiry, process_id = heapq.heappop(heap)
+            if expiry_by_pid.get(process_id) != expiry:
+                continue # renewed since, or already gone
+            del expiry_by_pid[process_id]
+            listener = group.pop(process_id, None)
+            if listener is None:
+                continue
+            GroupCoordinatorDaemon.record_change(process_id, None)
+            if GroupCoordinatorDaemon.pids_by_listener.get(listener) == process_id:
+                del GroupCoordinatorDaemon.pids_by_listener[listener]
+            if GroupCoordinatorDaemon.pids_by_student.get(process_id[1]) == process_id:
+                del GroupCoordinatorDaemon.pids_by_student[process_id[1]]
+            evicted += 1
+        GroupCoordinatorDaemon.evictions += evicted
+        return evicted
+
+    @staticmethod
+    def reap_forever(interval=1.0):
+        """
+        Evict expired members every interval seconds, so the group shrinks even
+        when no one is joining. Meant to run in a daemon thread.
+        """
+        while True:
+            time.sleep(interval)
+            with GroupCoordinatorDaemon.lock:
+                GroupCoordinatorDaemon.evict_expired()
+
+    @staticmethod
+    def reset():
+        """
+        Forget every member and start the membership log over. Lets one process
+        run several groups in a row against the same GCD (see election_sim.py).
+        """
+        with GroupCoordinatorDaemon.lock:
+            GroupCoordinatorDaemon.listeners_by_pid.clear()
+            GroupCoordinatorDaemon.pids_by_listener.clear()
+            GroupCoordinatorDaemon.pids_by_student.clear()
+            GroupCoordinatorDaemon.membership_log.clear()
+            GroupCoordinatorDaemon.membership_version = new_epoch()
+            GroupCoordinatorDaemon.lease_expiry.clear()
+            GroupCoordinatorDaemon.lease_heap.clear()
+
+    @staticmethod
+    def stats():
+        """
+        :return: {'members': group size, 'version': membership version,
+                  'evictions': expired leases, 'resolver': ResolverCache.stats()}
+        """
+        with GroupCoordinatorDaemon.lock:
+            GroupCoordinatorDaemon.evict_expired()
+            members = len(GroupCoordinatorDaemon.listeners_by_pid)
+            version = GroupCoordinatorDaemon.membership_version
+            evictions = GroupCoordinatorDaemon.evictions
+        return {'members': members, 'version': version, 'evictions': evictions,
+                'resolver': GroupCoordinatorDaemon.resolver.stats()}
+
+    @staticmethod
     def handle_join(message):
         """
         Process this BEGIN message by adding new member into the group data
@@ -47,7 +268,9 @@ We respond with a dictionary of group members.
         - of the right form
         - listener is on localhost (or equivalent)
         :param message: ('BEGIN', ((days_to_bd, su_id), (host, port)))
-        :return: GroupCoordinatorDaemon.listeners_by_pid
+                        or ('BEGIN', ((days_to_bd, su_id), (host, port), last_version))
+        :return: copy of GroupCoordinatorDaemon.listeners_by_pid, or
+                 membership_since(last_version) if a last_version was sent
         :raises ValueError: if the message cannot be validated
         """
         try:
@@ -59,16 +282,18 @@ We respond with a dictionary of group members.
             raise ValueError('Unexpected message: {}'.format(message_name))
         # pull apart message_data
         try:
-            process_id, listener = message_data
+            process_id, listener, *last_version = message_data
             listen_host, listen_port = listener
             days_to_birthday, student_id = process_id
         except (ValueError, TypeError):
             raise ValueError('Malformed message data, expected ((days_to_bd,su_id), (host, port))')
+        if last_version and not (len(last_version) == 1 and type(last_version[0]) is int and last_version[0] >= 0):
+            raise ValueError('Malformed membership version, expected a non-negative int')
         if not (type(days_to_birthday) is int and type(student_id) is int and 0 < days_to_birthday < 366 and 1_000_000 <= student_id < 10_000_000):
             raise ValueError('Malformed process id, expected(days_to_next_birthday, student_id)')
         # make sure that listen_host is localhost or equivalent
         try:
-            listen_ip = socket.gethostbyname(listen_host)
+            listen_ip = GroupCoordinatorDaemon.resolver.gethostbyname(listen_host)
         except Exception as err:
             raise ValueError(str(err))
         if not (type(listen_port) is int and 0 < listen_port < 65_536):
@@ -80,27 +305,121 @@ We respond with a dictionary of group members.
         students = GroupCoordinatorDaemon.pids_by_student
         group = GroupCoordinatorDaemon.listeners_by_pid
         listeners = GroupCoordinatorDaemon.pids_by_listener
-        # remove any old memberships for the same student
-        if student_id in students and students[student_id] != process_id:
-            old_pid = students[student_id]
-            del group[old_pid]
-        students[student_id] = process_id
-        # add this entry into group membership
-        group[process_id] = listener
-        # also remove any old memberships which claimed this same listener (host,port) pair
-        if listener in listeners and listeners[listener] != process_id:
-            old_pid = listeners[listener]
-            if old_pid in group:
-                del group[old_pid]
-        listeners[listener] = process_id
-        return group
+        record_change = GroupCoordinatorDaemon.record_change
+        with GroupCoordinatorDaemon.lock:
+            GroupCoordinatorDaemon.evict_expired()
+            # remove any old memberships for the same student
+            if student_id in students and students[student_id] != process_id:
+                old_pid = students[student_id]
+                if group.pop(old_pid, None) is not None:
+                    record_change(old_pid, None)
+            students[student_id] = process_id
+            # add this entry into group membership
+            if group.get(process_id) != listener:
+                group[process_id] = listener
+                record_change(process_id, listener)
+            # also remove any old memberships which claimed this same listener (host,port) pair
+            if listener in listeners and listeners[listener] != process_id:
+                old_pid = listeners[listener]
+                if old_pid in group:
+                    del group[old_pid]
+                    record_change(old_pid, None)
+            listeners[listener] = process_id
+            GroupCoordinatorDaemon.renew_lease(process_id)
+            # build the response while locked, it is pickled after other joins may have run
+            if last_version:
+                return GroupCoordinatorDaemon.membership_since(last_version[0])
+            return dict(group)
+
+    @staticmethod
+    def record_change(process_id, listener):
+        """
+        Append a change to the membership log. Caller must hold the lock.
+        :param process_id: member that changed
+        :param listener: its new listener, or None if it left the group
+        """
+        GroupCoordinatorDaemon.membership_version += 1
+        GroupCoordinatorDaemon.membership_log.append((GroupCoordinatorDaemon.membership_version, process_id, listener))
+
+    @staticmethod
+    def membership_since(last_version):
+        """
+        Describe how the group changed after last_version. Caller must hold the lock.
+        When the log still covers last_version and the changes are fewer than the
+        members, only the changes are sent; otherwise a compact snapshot is sent
+        instead, as it is for a version from another epoch (see new_epoch). Since every listener is on localhost_ip, the snapshot carries the
+        host once rather than once per member.
+        :param last_version: membership version the client last saw
+        :return: ('DELTA', version, {pid: listener added or moved}, (pids removed,))
+                 or ('SNAPSHOT', version, host, ((days_to_bd, su_id, port),))
+        """
+        version = GroupCoordinatorDaemon.membership_version
+        log = GroupCoordinatorDaemon.membership_log
+        group = GroupCoordinatorDaemon.listeners_by_pid
+        missed = version - last_version
+        oldest_logged = log[0][0] if log else version + 1
+        same_epoch = last_version >> EPOCH_SHIFT == version >> EPOCH_SHIFT
+        if same_epoch and 0 <= missed < len(group) and last_version + 1 >= oldest_logged:
+            latest = {}
+            for _, process_id, listener in islice(log, len(log) - missed, None):
+                latest[process_id] = listener
+            added = {pid: listener for pid, listener in latest.items() if listener is not None}
+            removed = tuple(pid for pid, listener in latest.items() if listener is None)
+            return 'DELTA', version, added, removed
+        members = tuple((days, su_id, port) for (days, su_id), (_, port) in group.items())
+        return 'SNAPSHOT', version, GroupCoordinatorDaemon.localhost_ip, members
+
+
+class ThreadPoolTCPServer(socketserver.TCPServer):
+    """
+    TCP server that hands every accepted connection to a fixed pool of worker
+    threads, so a slow or stalled client only ties up one worker instead of
+    blocking every other BEGIN behind it.
+    """
+    allow_reuse_address = True
+    request_queue_size = 128 # listen backlog, sized for join storms
+
+    def __init__(self, server_address, handler_class, max_workers):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gcd')
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+def make_server(port, workers=None):
+    """
+    Build the GCD server: the original single-threaded TCPServer, or a
+    ThreadPoolTCPServer when a number of workers is given.
+    """
+    if workers:
+        return ThreadPoolTCPServer(('', port), GroupCoordinatorDaemon, workers)
+    return socketserver.TCPServer(('', port), GroupCoordinatorDaemon)
+
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print("Usage: python gcd2.py GCDPORT")
+    if len(sys.argv) not in (2, 3, 4):
+        print("Usage: python gcd2.py GCDPORT [WORKERS] [LEASE_SECONDS]")
         exit(1)
-port = int(sys.argv[1])
-with socketserver.TCPServer(('', port), GroupCoordinatorDaemon) as server:
-    server.serve_forever()
+    port = int(sys.argv[1])
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    if len(sys.argv) > 3:
+        GroupCoordinatorDaemon.lease_time = float(sys.argv[3])
+    threading.Thread(target=GroupCoordinatorDaemon.reap_forever, daemon=True).start()
+    with make_server(port, workers) as server:
+        server.serve_forever()
+
 
 
@@ -0,0 +1,88 @@
+"""
+Load generator for the Group Coordinator Daemon.
+
+Starts a GCD on a loopback port inside this process, then has many client
+threads send BEGIN messages at once, the way a mass restart of the group does.
+A few clients connect and then stall without sending anything, which is what
+holds up every other join on the single-threaded server.
+
+Usage: python gcd_bench.py [CLIENTS] [JOINS_PER_CLIENT] [WORKERS] [STALLED]
+"""
+import pickle
+import socket
+import sys
+import threading
+import time
+
+import framing
+import gcd2
+
+
+def join(port, process_id, listen_port):
+    """Send one framed BEGIN and return its latency in seconds."""
+    message = ('BEGIN', (process_id, ('localhost', listen_port)))
+    started = time.perf_counter()
+    with socket.create_connection(('localhost', port)) as sock:
+        framing.send_frame(sock, pickle.dumps(message))
+        reply = pickle.loads(framing.recv_frame(sock))
+    if not isinstance(reply, dict):
+        raise RuntimeError('join refused: {}'.format(reply))
+    return time.perf_counter() - started
+
+
+def stall(port, seconds):
+    """Connect and say nothing, like a hung client."""
+    with socket.create_connection(('localhost', port)):
+        time.sleep(seconds)
+
+
+def run(clients, joins_per_client, workers, stalled):
+    """
+    Run one storm of clients * joins_per_client joins.
+
+    :return: (joins per second, p50 latency, p99 latency)
+    """
+    server = gcd2.make_server(0, workers)
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def client(index):
+        mine = []
+        for j in range(joins_per_client):
+            student_id = 1_000_000 + index * joins_per_client + j
+            process_id = (1 + student_id % 365, student_id)
+            mine.append(join(port, process_id, 10_000 + (student_id % 50_000)))
+        with latencies_lock:
+            latencies.extend(mine)
+
+    for _ in range(stalled):
+        threading.Thread(target=stall, args=(port, 1.0), daemon=True).start()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    server.shutdown()
+    server.server_close()
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return len(latencies) / elapsed, p50, p99
+
+
+if __name__ == '__main__':
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    joins_per_client = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+    stalled = int(sys.argv[4]) if len(sys.argv) > 4 else 2
+    for label, pool in (('single-threaded', None), ("thread pool x{}".format(workers), workers)):
+        rate, p50, p99 = run(clients, joins_per_client, pool, stalled)
+        print('{:<20} {:>8.0f} joins/s   p50 {:>7.2f} ms   p99 {:>7.2f} ms'.format(
+            label, rate, p50 * 1000, p99 * 1000))
+    print('resolver cache', gcd2.GroupCoordinatorDaemon.resolver.stats())
@@ -1,131 +1,698 @@
-from socketserver import ThreadingTCPServer, BaseRequestHandler
 import threading
 import sys
 import socket
+import selectors
+import queue
 import pickle
 import random
 import time as timestamp
+from concurrent.futures import ThreadPoolExecutor
 from datetime import *
 
+import codec
+import framing
+from failure_detector import LeaderMonitor
 
-# Declarations
-group_members: dict = {}
-higher_members: dict = {}
-leader = None
-election_in_progress = False
-
-def gcd_connection():
-    
-    """Communication initated with the GCD to register and get initial list of memebers"""
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listner:
-        listner.connect((gcd_host, gcd_port))
-        print(f"BEGIN ({gcd_host, gcd_port}) ({unique_id}) ({listen_host, listen_port})")
-        print(f"Sending BEGIN ({unique_id}) ({listen_host, listen_port})")
-        listner.sendall(pickle.dumps(('BEGIN', (unique_id, (listen_host, listen_port)))))
-        print(f"Receiving: ({unique_id}: {listen_host, listen_port})")
-        data = pickle.loads(listner.recv(1024))
-        print(f"Members: ({unique_id}: {data})")
-        return data
-
-def start_election():
-    
-    """Initiation of an Election
-    1. Sets the Election Progress value to true.
-    2. If any higher node is found declare victory else
-    3. Sends Election message to all nodes
+HEARTBEAT_INTERVAL = 20  # seconds between GCD lease renewals, well inside its 60 s lease
+PEER_TIMEOUT = 1.5  # seconds to wait on any one peer's connect or reply
+ELECTION_FANOUT = 8  # threads sending a node's peer messages, so most ELECTION messages in flight at once
+HANDLER_WORKERS = 4  # threads handling a node's incoming peer messages
+LISTEN_BACKLOG = 128  # peer connections waiting to be accepted
+COORDINATOR_TIMEOUT = 10  # seconds to wait for a COORDINATOR after an OK before electing again
+ANNOUNCE_FANOUT = 4  # subtrees per hop when a victory is announced as a tree, see BullyNode.announce
+POOL_IDLE_TIMEOUT = 30  # seconds an unused pooled peer connection is kept open
+POOL_MAX_IDLE = 4  # idle connections kept per peer
+
+def apply_membership_update(members, response):
+    """Fold a GCD response into a copy of members and return it with the new membership version.
+    The response is a full dictionary (the reply to an unversioned BEGIN, the only kind older GCDs
+    send), a DELTA or a SNAPSHOT.
+
+    >>> members, version = apply_membership_update({}, ('SNAPSHOT', 2, '127.0.0.1', ((5, 1000001, 4000), (9, 1000002, 4001))))
+    >>> members, version
+    ({(5, 1000001): ('127.0.0.1', 4000), (9, 1000002): ('127.0.0.1', 4001)}, 2)
+    >>> apply_membership_update(members, ('DELTA', 4, {(7, 1000003): ('127.0.0.1', 4002)}, ((5, 1000001),)))
+    ({(9, 1000002): ('127.0.0.1', 4001), (7, 1000003): ('127.0.0.1', 4002)}, 4)
     """
-    global election_in_progress, leader, higher_members
-
-    election_in_progress = True
-    higher_members = {}  # Reset higher_members
-    print(f"Starting election with ID: {unique_id}")
-    higher_members = {k: v for k, v in group_members.items() if k > unique_id}
-
-    # If no higher members are present then declare self as the winner
-    if not higher_members:
-        victory_declration()
-        
-    else:
-        # Send ELECTION messages to all higher members
-        responses = []
-        for addr in higher_members.values():
-            response = send_message(addr, ('ELECTION', group_members))
-            if response == 'OK':
-                responses.append(response)
-
-        # If no responses are given declare self as winner
-        if not responses:
-            victory_declration()
-
-def victory_declration():
-    """Declaring self as the new leader, stopping the election process and setting the election in progress variable to false"""
-    global leader, election_in_progress
-    leader = unique_id
-    election_in_progress = False
-    print(f"Victory by {leader}, no other bullies bigger than me.")
-
-    # Send COORDINATOR message to all members
-    for ids, addr in group_members.items():
-        send_message(addr, ('COORDINATOR', leader))
-
-def send_message(address, message):
-    """Send a pickled message to the given address."""
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect(address)
-            s.sendall(pickle.dumps(message))
-            print(f"Sending {message} to {address} ({threading.get_ident()})")
-            return pickle.loads(s.recv(1024))
-    except Exception as e:
-        return f"Error in sending message as {e}."
-
-class PeerHandler(BaseRequestHandler):
-    
-    """Handles incoming messages from other members.
-    Depending on the message type the respective action(function calls) is completed
+    if isinstance(response, dict):
+        return dict(response), 0
+    if isinstance(response, str):
+        raise ValueError(f"GCD refused BEGIN: {response}")
+    kind, version, *body = response
+    if kind == 'SNAPSHOT':
+        host, compact = body
+        return {(days, su_id): (host, port) for days, su_id, port in compact}, version
+    added, removed = body
+    updated = dict(members)
+    for pid in removed:
+        updated.pop(pid, None)
+    updated.update(added)
+    return updated, version
+
+class PeerConnectionPool(object):
+    """Keep-alive connections to peers, reused across messages.
+    Messages on a pooled connection are framed (see framing.py), encoded with encode (pickle.dumps or
+    codec.encode) and every one gets a framed reply,
+    so one connection carries any number of ELECTION, COORDINATOR and PROBE exchanges.
+    Connections that fail are closed. A message is retried on a fresh connection only if a reused one
+    failed before the peer could have seen it (the send failed, or the peer had already hung up);
+    a reply that times out is not retried, so a peer never gets the same message twice.
+    Connections left idle for idle_timeout seconds are closed by close_idle.
+    """
+
+    def __init__(self, idle_timeout=POOL_IDLE_TIMEOUT, max_idle_per_peer=POOL_MAX_IDLE, encode=pickle.dumps):
+        self.idle_timeout = idle_timeout
+        self.encode = encode
+        self.max_idle_per_peer = max_idle_per_peer
+        self.idle = {}  # [(socket, last used)] indexed by peer address, most recently used last
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+
+    def request(self, address, message, timeout=None):
+        """Send message to address and return the decoded reply.
+        :raises OSError: if a fresh connection fails too, or the reply does not come in time
+        :raises ValueError: if the reply is not a valid frame or message
+        """
+        while True:
+            sock, reused = self.checkout(address, timeout)
+            try:
+                sock.settimeout(timeout)
+                try:
+                    framing.send_frame(sock, self.encode(message))
+                except OSError:
+                    if not reused:
+                        raise
+                    sock.close()
+                    continue  # the peer dropped an idle connection, try again on a new one
+                if sock.recv(1, socket.MSG_PEEK) == b'':  # hung up without reading our message
+                    if not reused:
+                        raise ConnectionError('peer closed the connection')
+                    sock.close()
+                    continue
+                reply = codec.decode(framing.recv_frame(sock))
+            except BaseException:
+                sock.close()
+                raise
+            self.checkin(address, sock)
+            return reply
+
+    def checkout(self, address, timeout):
+        """Take an idle connection to address, or open a new one. Returns (socket, reused)."""
+        now = timestamp.monotonic()
+        with self.lock:
+            idle = self.idle.get(address, [])
+            while idle:
+                sock, last_used = idle.pop()
+                if now - last_used < self.idle_timeout:
+                    return sock, True
+                sock.close()
+        sock = socket.create_connection(address, timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        return sock, False
+
+    def checkin(self, address, sock):
+        with self.lock:
+            idle = self.idle.setdefault(address, [])
+            if len(idle) < self.max_idle_per_peer and not self.closed.is_set():
+                idle.append((sock, timestamp.monotonic()))
+                return
+        sock.close()
+
+    def close_idle(self, max_idle_time=None):
+        """Close connections that have been idle for longer than max_idle_time (default idle_timeout)."""
+        max_idle_time = self.idle_timeout if max_idle_time is None else max_idle_time
+        now = timestamp.monotonic()
+        with self.lock:
+            for address in list(self.idle):
+                keep = []
+                for sock, last_used in self.idle[address]:
+                    if now - last_used < max_idle_time:
+                        keep.append((sock, last_used))
+                    else:
+                        sock.close()
+                if keep:
+                    self.idle[address] = keep
+                else:
+                    del self.idle[address]
+
+    def close_idle_forever(self):
+        """Run close_idle every so often until close() is called; meant for a daemon thread."""
+        while not self.closed.wait(self.idle_timeout / 2):
+            self.close_idle()
+
+    def close(self):
+        """Close every idle connection and stop pooling new ones."""
+        self.closed.set()
+        self.close_idle(max_idle_time=0)
+
+class PeerServer(object):
+    """Serves a BullyNode's peers with one selector thread and a fixed pool of handler threads.
+    The selector thread only waits for connections to become readable. A handler thread then reads one
+    message, passes it to node.handle_message and replies; a pooled (framed) connection then goes back to
+    the selector. So an idle connection costs no thread, and handler threads stay at `workers` however
+    many peers connect.
     """
 
-    def handle(self):
-        global election_in_progress, leader, group_members
+    def __init__(self, server_address, node, workers=HANDLER_WORKERS):
+        self.node = node
+        self.socket = socket.create_server(server_address, backlog=LISTEN_BACKLOG)
+        self.socket.setblocking(False)
+        self.server_address = self.socket.getsockname()
+        self.selector = selectors.DefaultSelector()
+        self.handlers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='peer-handler')
+        self.finished = queue.SimpleQueue()  # (connection, keep open) from handler threads
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.waiting = {}  # connection -> when it was last handed to the selector
+        self.busy = set()  # connections a handler thread is working on
+        self.connections_lock = threading.Lock()
+        self.closed = threading.Event()
+
+    def serve_forever(self):
+        """Accept and dispatch until close() is called; meant for a daemon thread."""
+        self.selector.register(self.socket, selectors.EVENT_READ)
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ)
+        last_sweep = timestamp.monotonic()
+        try:
+            while not self.closed.is_set():
+                for key, _ in self.selector.select(timeout=1.0):
+                    if key.fileobj is self.socket:
+                        self.accept()
+                    elif key.fileobj is self.wakeup_recv:
+                        self.wakeup_recv.recv(4096)
+                    else:
+                        self.dispatch(key.fileobj)
+                self.take_back()
+                if timestamp.monotonic() - last_sweep > 1.0:
+                    self.close_idle(POOL_IDLE_TIMEOUT * 2)
+                    last_sweep = timestamp.monotonic()
+        except (OSError, ValueError, RuntimeError):
+            if not self.closed.is_set():
+                raise  # otherwise close() pulled the socket or the handler pool out from under us
+        finally:
+            self.close_idle(0)
+            self.selector.close()
+
+    def accept(self):
+        while True:
+            try:
+                conn, _ = self.socket.accept()
+            except OSError:
+                return
+            with self.connections_lock:
+                self.waiting[conn] = timestamp.monotonic()
+            self.selector.register(conn, selectors.EVENT_READ)
+
+    def dispatch(self, conn):
+        """Hand a readable connection to a handler thread."""
+        self.selector.unregister(conn)
+        with self.connections_lock:
+            del self.waiting[conn]
+            self.busy.add(conn)
+        self.handlers.submit(self.handle, conn)
+
+    def take_back(self):
+        """Return connections the handler threads are done with to the selector, or close them."""
+        while True:
+            try:
+                conn, keep = self.finished.get_nowait()
+            except queue.Empty:
+                return
+            with self.connections_lock:
+                self.busy.discard(conn)
+                if keep and not self.closed.is_set():
+                    self.waiting[conn] = timestamp.monotonic()
+            if keep and not self.closed.is_set():
+                self.selector.register(conn, selectors.EVENT_READ)
+            else:
+                conn.close()
+
+    def close_idle(self, max_idle_time):
+        """Close connections that have been waiting for a message for longer than max_idle_time."""
+        now = timestamp.monotonic()
+        with self.connections_lock:
+            idle = [conn for conn, since in self.waiting.items() if now - since >= max_idle_time]
+            for conn in idle:
+                del self.waiting[conn]
+        for conn in idle:
+            try:
+                self.selector.unregister(conn)
+            except (KeyError, ValueError):
+                pass
+            conn.close()
+
+    def handle(self, conn):
+        """Read one message from conn, act on it and reply; runs on a handler thread.
+        A connection that starts with a frame header comes from a PeerConnectionPool: every message on it
+        is answered (ACK where the protocol has no reply) and it stays open for the next one.
+        Messages may be pickled or binary (see codec.py); the reply is encoded the same way as the message.
+        """
+        node = self.node
+        keep = False
+        try:
+            conn.settimeout(PEER_TIMEOUT)
+            first = conn.recv(1, socket.MSG_PEEK)
+            if first:
+                node.log(f"\nSTARTING PROCESS for pid {node.unique_id} on {conn.getpeername()} ")
+                node.log(f"BEGIN {self.server_address}, {node.unique_id}")
+                if framing.is_framed(first):
+                    payload = framing.recv_frame(conn)
+                    reply = node.handle_message(*codec.decode(payload))
+                    encode = codec.encode if codec.is_binary(payload) else pickle.dumps
+                    framing.send_frame(conn, encode('ACK' if reply is None else reply))
+                    keep = True
+                else:
+                    payload = conn.recv(1024)
+                    reply = node.handle_message(*codec.decode(payload))
+                    if reply is not None:
+                        encode = codec.encode if codec.is_binary(payload) else pickle.dumps
+                        conn.sendall(encode(reply))
+        except (ConnectionError, socket.timeout):
+            keep = False  # peer went away mid-message
+        except Exception as e:
+            keep = False
+            if not self.closed.is_set():
+                node.log(f"Error handling peer message: {e}")
+        self.finished.put((conn, keep))
+        try:
+            self.wakeup_send.send(b'\0')
+        except OSError:
+            pass
+
+    def close(self):
+        """Stop accepting, drop every connection and stop the handler threads."""
+        self.closed.set()
+        self.socket.close()
+        with self.connections_lock:
+            connections = list(self.waiting) + list(self.busy)
+        for conn in connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        try:
+            self.wakeup_send.send(b'\0')
+        except OSError:
+            pass
+        self.handlers.shutdown(wait=False, cancel_futures=True)
+
+class BullyNode(object):
+    """One member of the bully group: its listening server, its view of the group and its election state.
+    Several nodes can run in one process (see election_sim.py); lab2.py as a script runs just one.
+
+    leader, election_in_progress and group_members are only ever changed by run_events, which applies
+    queued events one at a time. Peer handlers, the heartbeat loop and the failure detector post events
+    instead of changing them, so elections never overlap and nobody blocks waiting on one.
+    Other threads may read these fields; group_members is replaced rather than changed in place.
+    """
+
+    def __init__(self, gcd_address, unique_id, listen_host='localhost', listen_port=0,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, monitor_leader=True, announce_fanout=None, binary=False,
+                 framed=False, pooled=False, verbose=True):
+        """
+        :param gcd_address: (host, port) of the Group Coordinator Daemon
+        :param unique_id: (days_left_for_birthday, su_id)
+        :param listen_port: port to listen on for peers, 0 to pick a free one
+        :param heartbeat_interval: seconds between GCD lease renewals, None to never renew
+        :param monitor_leader: whether to run a LeaderMonitor against the leader
+        :param announce_fanout: None to send our COORDINATOR to every member in turn,
+                                or the number of subtrees to announce a victory through (see announce)
+        :param binary: whether to send messages in codec.py's binary encoding rather than pickled
+        :param framed: whether the GCD is gcd2.py, so BEGIN can be framed and versioned and leases renewed
+                       with HEARTBEAT; otherwise a plain pickled BEGIN is sent, as any GCD understands
+        :param pooled: whether every peer runs this lab2.py, so messages can go framed over pooled
+                       connections (see PeerConnectionPool); otherwise each message gets a fresh
+                       unframed connection, as any peer understands
+        :param verbose: whether to print what the node is doing
+        """
+        self.gcd_host, self.gcd_port = gcd_address
+        self.unique_id = unique_id
+        self.heartbeat_interval = heartbeat_interval
+        self.announce_fanout = announce_fanout
+        self.encode = codec.encode if binary else pickle.dumps
+        self.framed = framed
+        self.verbose = verbose
+        self.group_members = {}
+        self.higher_members = {}
+        self.leader = None
+        self.election_in_progress = False
+        self.election_epoch = 0  # bumped whenever an election starts or ends, so late replies are ignored
+        self.waiting_since = None  # when an OK told us to wait for the COORDINATOR
+        self.membership_version = 0  # last membership version received from the GCD
+        self.events = queue.Queue()  # (event, data) for run_events
+        self.messages_sent = 0
+        self.counter_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.peer_pool = PeerConnectionPool(encode=self.encode) if pooled else None
+        self.sender = ThreadPoolExecutor(max_workers=ELECTION_FANOUT, thread_name_prefix='peer-sender')
+        self.monitor = LeaderMonitor(self.leader_to_watch, self.probe_leader, self.leader_failed) if monitor_leader else None
+        self.server = PeerServer((listen_host, listen_port), self)
+        self.listen_host, self.listen_port = listen_host, self.server.server_address[1]
+
+    def log(self, text):
+        if self.verbose:
+            print(text)
+
+    def start(self, elect=True):
+        """Start serving peers, register with the GCD, hold a first election (unless elect is false)
+        and start watching the leader."""
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        if self.peer_pool is not None:
+            threading.Thread(target=self.peer_pool.close_idle_forever, daemon=True).start()
+        self.log(f"Server Loop Running in Thread: {threading.current_thread().name}")
+
+        # Register with GCD and get initial list of members
+        self.handle_event('GCD_REPLY', self.gcd_connection())
+        threading.Thread(target=self.run_events, daemon=True).start()
+        if self.heartbeat_interval:
+            threading.Thread(target=self.send_heartbeats, daemon=True).start()
+        if elect:
+            self.request_election()
 
+        # Watch the leader from here on
+        if self.monitor is not None:
+            threading.Thread(target=self.monitor.run, daemon=True).start()
+
+    def stop(self):
+        """Stop as if crashed: stop listening, drop every connection and stop all background work."""
+        self.stop_event.set()
+        self.post('STOP')
+        if self.monitor is not None:
+            self.monitor.stop()
+        self.server.close()
+        self.sender.shutdown(wait=False, cancel_futures=True)
+        if self.peer_pool is not None:
+            self.peer_pool.close()
+
+    def gcd_connection(self, version=None):
+
+        """Communication initated with the GCD to register and get the list of memebers.
+        When framed, the BEGIN carries the last membership version we saw (or version, if given), so the
+        GCD only sends what changed since; otherwise it is the plain BEGIN and the GCD answers with every member.
+        Returns the GCD's response, to be applied as a GCD_REPLY event.
+        """
+        if version is None:
+            version = self.membership_version
+        gcd_host, gcd_port = self.gcd_host, self.gcd_port
+        unique_id, listen_host, listen_port = self.unique_id, self.listen_host, self.listen_port
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listner:
+            listner.connect((gcd_host, gcd_port))
+            self.log(f"BEGIN ({gcd_host, gcd_port}) ({unique_id}) ({listen_host, listen_port})")
+            self.log(f"Sending BEGIN ({unique_id}) ({listen_host, listen_port})")
+            self.log(f"Receiving: ({unique_id}: {listen_host, listen_port})")
+            if self.framed:
+                framing.send_frame(listner, self.encode(('BEGIN', (unique_id, (listen_host, listen_port), version))))
+                response = codec.decode(framing.recv_frame(listner))
+            else:
+                listner.sendall(self.encode(('BEGIN', (unique_id, (listen_host, listen_port)))))
+                chunks = []
+                while True:  # the GCD closes the connection after its reply
+                    chunk = listner.recv(4096)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                response = codec.decode(b''.join(chunks))
+            self.log(f"Members: ({unique_id}: {response})")
+            return response
+
+    def send_heartbeat(self):
+        """Renew our GCD lease.
+        The reply tells us who joined or had their lease expire, so dead members drop out of group_members.
+        If the GCD no longer knows us (say it restarted) we register again with BEGIN.
+        When not framed the GCD may not know HEARTBEAT, so we send BEGIN again instead.
+        """
         try:
-            print(f"\nSTARTING PROCESS for pid {unique_id} on {self.client_address} ")
-            print(f"BEGIN {self.server.server_address}, {unique_id}")
-            message_name, message_data = pickle.loads(self.request.recv(1024))
-            print(f"Receiving {message_data} from {threading.get_ident()}")
+            if not self.framed:
+                self.post('GCD_REPLY', self.gcd_connection())
+                return
+            with socket.create_connection((self.gcd_host, self.gcd_port), timeout=HEARTBEAT_INTERVAL) as gcd:
+                framing.send_frame(gcd, self.encode(('HEARTBEAT', (self.unique_id, self.membership_version))))
+                response = codec.decode(framing.recv_frame(gcd))
+            if isinstance(response, str):
+                self.log(f"Lease lost ({response}), registering again")
+                # our version is from the GCD's old history, so ask for a SNAPSHOT and let run_events start over from it
+                self.post('GCD_RESET', self.gcd_connection(version=0))
+                return
+            self.post('GCD_REPLY', response)
+        except (OSError, ValueError) as e:
+            self.log(f"Heartbeat to GCD failed: {e}")
+
+    def send_heartbeats(self):
+        """Call send_heartbeat every heartbeat_interval seconds until stopped; meant for a daemon thread."""
+        while not self.stop_event.wait(self.heartbeat_interval):
+            self.send_heartbeat()
+
+    def post(self, event, data=None):
+        """Queue an event for run_events."""
+        self.events.put((event, data))
+
+    def request_election(self):
+        """Ask for an election; ignored if one is already running."""
+        self.post('START')
+
+    def run_events(self):
+        """Apply queued events one at a time until stopped; meant for a daemon thread.
+        While we wait for a COORDINATOR the wait is bounded by COORDINATOR_TIMEOUT, after which we elect again.
+        """
+        while not self.stop_event.is_set():
+            timeout = None
+            if self.waiting_since is not None:
+                timeout = max(0.0, self.waiting_since + COORDINATOR_TIMEOUT - timestamp.monotonic())
+            try:
+                event, data = self.events.get(timeout=timeout)
+            except queue.Empty:
+                event, data = 'COORDINATOR_TIMEOUT', self.election_epoch
+            if event == 'STOP':
+                return
+            try:
+                self.handle_event(event, data)
+            except Exception as e:
+                if not self.stop_event.is_set():
+                    self.log(f"Error handling {event}: {e}")
+
+    def handle_event(self, event, data):
+        """Apply one event to the election state. Only run_events calls this once the node has started."""
+        if event == 'GCD_REPLY':
+            self.group_members, self.membership_version = apply_membership_update(self.group_members, data)
+
+        elif event == 'GCD_RESET':
+            # we registered again from version 0, so the reply replaces our view from the GCD's old history
+            self.group_members, self.membership_version = apply_membership_update({}, data)
+
+        elif event == 'START':
+            if not self.election_in_progress:
+                self.start_election()
+
+        elif event == 'ELECTION':
+            self.group_members = {**self.group_members, **data}
+            if not self.election_in_progress:
+                self.start_election()
+
+        elif event == 'OK':
+            # a higher member answered, it takes over and we wait for its COORDINATOR
+            if data == self.election_epoch and self.waiting_since is None:
+                self.waiting_since = timestamp.monotonic()
+
+        elif event == 'NO_OK':
+            if data == self.election_epoch and self.waiting_since is None:
+                self.victory_declration()
+
+        elif event == 'COORDINATOR_TIMEOUT':
+            if data == self.election_epoch and self.waiting_since is not None:
+                self.log("No COORDINATOR arrived, starting the election again")
+                self.start_election()
+
+        elif event == 'COORDINATOR':
+            self.leader = data
+            self.election_in_progress = False
+            self.election_epoch += 1
+            self.waiting_since = None
+            self.log(f"New leader elected: {self.leader}")
+            if self.leader not in self.group_members:
+                # we need its address to PROBE it, the GCD can tell us
+                self.sender.submit(self.send_heartbeat)
+
+    def start_election(self):
+
+        """Initiation of an Election
+        1. Sets the Election Progress value to true.
+        2. If any higher node is found declare victory else
+        3. Sends Election message to all nodes, concurrently; the first OK or the lack of any arrives as an event
+        """
+        if self.stop_event.is_set():
+            return
+        self.election_in_progress = True
+        self.election_epoch += 1
+        self.waiting_since = None
+        self.higher_members = {}  # Reset higher_members
+        self.log(f"Starting election with ID: {self.unique_id}")
+        self.higher_members = {k: v for k, v in self.group_members.items() if k > self.unique_id}
 
-            if message_name == 'BEGIN':
-                print(f"Members: {group_members}. Starting an election at startup.")
-                start_election()
+        # If no higher members are present then declare self as the winner
+        if not self.higher_members:
+            self.victory_declration()
 
-            if message_name == 'ELECTION':
-                group_members.update(message_data)
-                self.request.sendall(pickle.dumps('OK'))
+        else:
+            # Send ELECTION messages to all higher members
+            # If no responses are given declare self as winner
+            self.send_election(self.election_epoch, self.higher_members.values(), ('ELECTION', self.group_members))
 
-                if not election_in_progress:
-                    start_election()
+    def send_election(self, epoch, addresses, message):
+        """Send message to every address on the sender pool, then post OK for epoch at the first OK reply,
+        or NO_OK once every peer has failed to answer OK.
+        Each peer gets PEER_TIMEOUT, so a hung peer can't stall us; the first OK is enough to hand off
+        leadership, so sends still queued behind it are cancelled.
+        """
+        lock = threading.Lock()
+        outcome = {'pending': len(addresses), 'ok': False}
+        futures = []
 
-            elif message_name == 'COORDINATOR':
-                leader = message_data
-                election_in_progress = False
-                print(f"New leader elected: {leader}")
+        def done(future):
+            with lock:
+                outcome['pending'] -= 1
+                if outcome['ok']:
+                    return
+                ok = not future.cancelled() and future.exception() is None and future.result() == 'OK'
+                if ok:
+                    outcome['ok'] = True
+                elif outcome['pending']:
+                    return
+            if ok:
+                for other in futures:
+                    other.cancel()
+            self.post('OK' if ok else 'NO_OK', epoch)
 
-            elif message_name == 'PROBE':
-                self.request.sendall(pickle.dumps('OK'))
+        futures.extend(self.sender.submit(self.send_message, addr, message, PEER_TIMEOUT) for addr in addresses)
+        for future in futures:
+            future.add_done_callback(done)
 
+    def victory_declration(self):
+        """Declaring self as the new leader, stopping the election process and setting the election in progress variable to false"""
+        self.leader = self.unique_id
+        self.election_in_progress = False
+        self.election_epoch += 1
+        self.waiting_since = None
+        self.log(f"Victory by {self.leader}, no other bullies bigger than me.")
+
+        # Send COORDINATOR message to all other members, off the event thread
+        addresses = [addr for pid, addr in self.group_members.items() if pid != self.unique_id]
+        self.sender.submit(self.announce, self.leader, addresses, self.announce_fanout)
+
+    def announce(self, leader, addresses, fanout=None):
+        """Tell every address in addresses that leader won.
+        Without a fanout, COORDINATOR goes to each address in turn, which takes O(N) sends on this node.
+        With one, the addresses are split into fanout subtrees and each subtree is handed to its first
+        member as an ANNOUNCE, which splits the rest of it the same way. The whole group then hears in
+        O(log N) hops and no node sends more than fanout messages per hop.
+        """
+        if not fanout:
+            for addr in addresses:
+                self.send_message(addr, ('COORDINATOR', leader), PEER_TIMEOUT)
+            return
+        size = -(-len(addresses) // fanout)
+        for i in range(0, len(addresses), size):
+            self.sender.submit(self.forward_announcement, leader, addresses[i:i + size], fanout)
+
+    def forward_announcement(self, leader, subtree, fanout):
+        """Send ANNOUNCE to the first member of subtree that answers, handing it the rest of the subtree.
+        A member that is down is skipped, so its part of the tree is not lost with it.
+        """
+        for i, addr in enumerate(subtree):
+            if self.send_message(addr, ('ANNOUNCE', (leader, fanout, subtree[i + 1:])), PEER_TIMEOUT) == 'ACK':
+                return
+
+    def leader_to_watch(self):
+        """The leader the failure detector should PROBE, or None while there is nothing to watch."""
+        leader, members = self.leader, self.group_members
+        if leader is None or leader == self.unique_id or self.election_in_progress or leader not in members:
+            return None
+        return leader
+
+    def probe_leader(self, pid):
+        """PROBE the given leader and report whether it answered OK."""
+        return self.send_message(self.group_members[pid], ('PROBE', None), PEER_TIMEOUT) == 'OK'
+
+    def leader_failed(self, pid):
+        """Called by the failure detector once it suspects the leader has crashed."""
+        self.log(f"Leader {pid} stopped answering PROBEs, starting an election")
+        self.request_election()
+
+    def handle_message(self, message_name, message_data):
+        """Act on one message from a peer and return the reply, or None where the protocol has none.
+        Runs on a PeerServer handler thread, so anything that changes election state is posted as an event.
+        """
+        self.log(f"Receiving {message_data} from {threading.get_ident()}")
+
+        if message_name == 'BEGIN':
+            self.log(f"Members: {self.group_members}. Starting an election at startup.")
+            self.request_election()
+
+        elif message_name == 'ELECTION':
+            self.post('ELECTION', message_data)
+            return 'OK'
+
+        elif message_name == 'COORDINATOR':
+            self.post('COORDINATOR', message_data)
+
+        elif message_name == 'ANNOUNCE':
+            # a COORDINATOR with the part of the group we should pass it on to
+            leader, fanout, subtree = message_data
+            self.post('COORDINATOR', leader)
+            if subtree:
+                self.sender.submit(self.announce, leader, subtree, fanout)
+            return 'ACK'
+
+        elif message_name == 'PROBE':
+            return 'OK'
+
+        elif message_name == 'METRICS':
+            return self.monitor.metrics() if self.monitor is not None else {}
+        return None
+
+    def send_message(self, address, message, timeout=None):
+        """Send a message (pickled, or binary if the node was made with binary) to the given address, waiting at most timeout seconds on each socket operation.
+        Goes through peer_pool when there is one.
+        """
+        if self.stop_event.is_set():
+            return "Error in sending message as this node is stopped."  # a crashed node sends nothing
+        with self.counter_lock:
+            self.messages_sent += 1
+        try:
+            if self.peer_pool is not None:
+                self.log(f"Sending {message} to {address} ({threading.get_ident()})")
+                return self.peer_pool.request(tuple(address), message, timeout)
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                s.settimeout(timeout)
+                s.connect(address)
+                s.sendall(self.encode(message))
+                self.log(f"Sending {message} to {address} ({threading.get_ident()})")
+                return codec.decode(s.recv(1024))
         except Exception as e:
-            print(f"Error handling peer message: {e}")
+            return f"Error in sending message as {e}."
 
 if __name__ == '__main__':
 
-    if len(sys.argv) != 5:
-        print("Usage: python lab2.py <hostname> <port> <days_left_for_birthday> <su_id>")
+    binary = '--binary' in sys.argv
+    framed = '--framed' in sys.argv  # the GCD is gcd2.py: versioned BEGIN and HEARTBEAT leases
+    pooled = '--pooled' in sys.argv  # every peer is this lab2.py: framed messages over pooled connections
+    args = [arg for arg in sys.argv if arg not in ('--binary', '--framed', '--pooled')]
+    announce_fanout = None  # every peer is this lab2.py: victories are announced as a tree of ANNOUNCEs
+    if '--announce-fanout' in args:
+        i = args.index('--announce-fanout')
+        try:
+            announce_fanout = int(args[i + 1])
+        except (IndexError, ValueError):
+            announce_fanout = 0
+        del args[i:i + 2]
+    if len(args) != 5 or announce_fanout is not None and announce_fanout < 1:
+        print("Usage: python lab2.py <hostname> <port> <days_left_for_birthday> <su_id> [--binary] [--framed] [--pooled]"
+              " [--announce-fanout N]")
         sys.exit(1)
 
-    gcd_host = sys.argv[1]
-    gcd_port = int(sys.argv[2])
-    days_left_for_birthday = int(sys.argv[3])
-    su_id = int(sys.argv[4])
+    gcd_host = args[1]
+    gcd_port = int(args[2])
+    days_left_for_birthday = int(args[3])
+    su_id = int(args[4])
 
     unique_id = (days_left_for_birthday, su_id)
     listen_host = 'localhost'
@@ -135,14 +702,10 @@ if __name__ == '__main__':
     print(f"Next Birthday on: {upcoming_birthday}")
     print(f"SeattleU ID: {su_id}")
 
-    # Start the listening server
-    server = ThreadingTCPServer((listen_host, listen_port), PeerHandler)
-    threading.Thread(target=server.serve_forever, daemon=True).start()
-    print(f"Server Loop Running in Thread: {threading.current_thread().name}")
-
-    # Register with GCD and get initial list of members
-    group_members = gcd_connection()
-    start_election()
+    # Start the listening server, register with the GCD and hold the first election
+    node = BullyNode((gcd_host, gcd_port), unique_id, listen_host, listen_port, binary=binary, framed=framed,
+                     pooled=pooled, announce_fanout=announce_fanout)
+    node.start()
 
     # Keep the main thread alive
     try:
@@ -150,4 +713,5 @@ if __name__ == '__main__':
             timestamp.sleep(1)
     except KeyboardInterrupt:
         print("Closing Terminal")
-        server.shutdown()
+        print(f"Failure detector: {node.monitor.metrics()}")
+        node.stop()
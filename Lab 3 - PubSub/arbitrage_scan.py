@@ -0,0 +1,237 @@
+"""
+CPSC 5520, Seattle University
+Assignment Name: Pub/Sub Assignment
+Author: Rupeshwar Rao
+
+Arbitrage scan of a BellmanFord graph across a process pool.
+
+The graph goes to the workers as its compact edge arrays (vertex numbers and
+weights in array('l')/array('d'), see bellman_ford.EdgeArrays) rather than as
+a pickled BellmanFord. Two ways to split the work:
+
+- 'sources': the vertices are dealt out to the workers, and each runs
+  Bellman-Ford from each of its vertices and follows the negative cycle that
+  run reports, if any, back through the predecessors.
+- 'components': a negative cycle never leaves a strongly connected component,
+  so each component with a cycle in it is scanned on its own, with
+  BellmanFord.negative_cycles.
+
+Either way, the cycles come back as vertex numbers rotated to start at the
+lowest, so the same cycle found by several workers is merged into one.
+"""
+from array import array
+
+from bellman_ford import BellmanFord
+
+
+def pack(graph):
+    """
+    The graph's edges as (vertex count, sources, destinations, weights), for a worker.
+    """
+    arrays = graph.compile()
+    return len(arrays.vertices), arrays.sources, arrays.destinations, arrays.weights
+
+
+def unpack_rows(packed):
+    """
+    Group packed edges by source, as EdgeArrays.rows (the flat arrays are in row order).
+    """
+    n, sources, destinations, weights = packed
+    rows = []
+    for u, v, w in zip(sources, destinations, weights):
+        if not rows or rows[-1][0] != u:
+            rows.append((u, [], []))
+        rows[-1][1].append(v)
+        rows[-1][2].append(w)
+    return rows
+
+
+def canonical(loop):
+    """Rotate a cycle of vertex numbers (without the closing repeat) to start at its lowest."""
+    lowest = loop.index(min(loop))
+    return tuple(loop[lowest:] + loop[:lowest])
+
+
+def scan_sources(packed, starts, tolerance=0):
+    """
+    Run Bellman-Ford from each of starts and follow the negative cycle each run detects.
+
+    :param packed: edges from pack()
+    :param starts: vertex numbers to start from
+    :return: ({cycle as canonical vertex numbers: weight}, passes, relaxations)
+    """
+    n, sources, destinations, weights = packed
+    rows = unpack_rows(packed)
+    weight_of = {(u, v): w for u, v, w in zip(sources, destinations, weights)}
+    inf = float('inf')
+    cycles = {}
+    passes = relaxations = 0
+    for start in starts:
+        distance, predecessor = [inf] * n, [None] * n
+        distance[start] = 0
+        edge = None
+        for i in range(n + 1):  # the last pass is the negative cycle check
+            passes += 1
+            relaxed = False
+            for u, targets, row_weights in rows:
+                du = distance[u]
+                if du == inf:
+                    continue
+                for v, w in zip(targets, row_weights):
+                    if distance[v] - (du + w) > tolerance:
+                        if v == start or i == n:
+                            edge = (u, v)
+                            break
+                        distance[v] = du + w
+                        predecessor[v] = u
+                        relaxations += 1
+                        relaxed = True
+                if edge is not None:
+                    break
+            if edge is not None or not relaxed:
+                break
+        if edge is None:
+            continue
+        # n steps back from the relaxed edge's end are sure to be on the cycle
+        u, v = edge
+        predecessor[v] = u
+        for i in range(n):
+            v = predecessor[v]
+            if v is None:
+                break
+        if v is None:
+            continue
+        loop = [v]
+        u = predecessor[v]
+        while u != v:
+            loop.append(u)
+            u = predecessor[u]
+        loop.reverse()  # predecessors run against the edges
+        key = canonical(loop)
+        weight = sum(weight_of[key[k], key[(k + 1) % len(key)]] for k in range(len(key)))
+        if weight < -tolerance:
+            cycles[key] = weight
+    return cycles, passes, relaxations
+
+
+def scan_component(packed, tolerance=0):
+    """
+    Find the negative cycles of one strongly connected component.
+
+    :param packed: the component's edges from pack(), vertex numbers as in the whole graph
+    :return: ({cycle as canonical vertex numbers: weight}, passes, relaxations)
+    """
+    n, sources, destinations, weights = packed
+    graph = BellmanFord()
+    for u, v, w in zip(sources, destinations, weights):
+        graph.add_edge(u, v, w)
+    cycles = {canonical(cycle[:-1]): weight for cycle, weight in graph.negative_cycles(tolerance)}
+    return cycles, graph.last_run['passes'], graph.last_run['relaxations']
+
+
+def strongly_connected_components(n, rows):
+    """
+    Tarjan's algorithm, without recursion.
+
+    >>> sorted(sorted(c) for c in strongly_connected_components(4, [(0, [1], []), (1, [0, 2], []), (2, [3], [])]))
+    [[0, 1], [2], [3]]
+
+    :return: list of components, each a list of vertex numbers
+    """
+    adjacency = [()] * n
+    for u, targets, _ in rows:
+        adjacency[u] = targets
+    index, low = [None] * n, [0] * n
+    on_stack = [False] * n
+    stack, components = [], []
+    counter = 0
+    for root in range(n):
+        if index[root] is not None:
+            continue
+        work = [(root, 0)]
+        while work:
+            u, k = work.pop()
+            if k == 0:
+                index[u] = low[u] = counter
+                counter += 1
+                stack.append(u)
+                on_stack[u] = True
+            else:
+                low[u] = min(low[u], low[adjacency[u][k - 1]])
+            while k < len(adjacency[u]):
+                v = adjacency[u][k]
+                k += 1
+                if index[v] is None:
+                    work.append((u, k))
+                    work.append((v, 0))
+                    break
+                if on_stack[v]:
+                    low[u] = min(low[u], index[v])
+            else:
+                if low[u] == index[u]:
+                    component = []
+                    while True:
+                        v = stack.pop()
+                        on_stack[v] = False
+                        component.append(v)
+                        if v == u:
+                            break
+                    components.append(component)
+    return components
+
+
+def partition(packed, mode, workers):
+    """
+    Split the scan of packed into tasks.
+    :return: list of (function, args) to run in the pool
+    """
+    n, sources, destinations, weights = packed
+    if mode == 'sources':
+        chunks = [list(range(n))[k::workers] for k in range(workers)]
+        return [(scan_sources, (packed, chunk)) for chunk in chunks if chunk]
+    if mode != 'components':
+        raise ValueError('unknown scan mode {!r}'.format(mode))
+    component_of = [None] * n
+    components = [c for c in strongly_connected_components(n, unpack_rows(packed)) if len(c) > 1]
+    for c, component in enumerate(components):
+        for v in component:
+            component_of[v] = c
+    edges = [(array('l'), array('l'), array('d')) for _ in components]
+    for u, v, w in zip(sources, destinations, weights):
+        c = component_of[u]
+        if c is not None and c == component_of[v]:
+            edges[c][0].append(u)
+            edges[c][1].append(v)
+            edges[c][2].append(w)
+    return [(scan_component, ((n,) + edges[c],)) for c in range(len(components))]
+
+
+def scan(graph, executor=None, mode='sources', workers=1, tolerance=0, totals=None):
+    """
+    Find the graph's negative cycles across a process pool.
+
+    :param graph: BellmanFord graph
+    :param executor: concurrent.futures executor (a ProcessPoolExecutor) to run the tasks in,
+                     or None to run them here
+    :param mode: 'sources' or 'components', see the module docstring
+    :param workers: number of tasks to split 'sources' into, normally the executor's max_workers
+    :param tolerance: as for BellmanFord.shortest_paths
+    :param totals: if given, a dict whose 'passes' and 'relaxations' get the workers' counts added
+    :return: list of (cycle, weight) sorted by weight, as BellmanFord.negative_cycles returns
+    """
+    packed = pack(graph)
+    tasks = partition(packed, mode, workers)
+    if executor is None:
+        results = [function(*args, tolerance) for function, args in tasks]
+    else:
+        futures = [executor.submit(function, *args, tolerance) for function, args in tasks]
+        results = [future.result() for future in futures]
+    merged = {}
+    for cycles, passes, relaxations in results:
+        merged.update(cycles)
+        if totals is not None:
+            totals['passes'] += passes
+            totals['relaxations'] += relaxations
+    vertices = graph.compile().vertices
+    return sorted((([vertices[u] for u in key] + [vertices[key[0]]], weight) for key, weight in merged.items()),
+                  key=lambda found: found[1])
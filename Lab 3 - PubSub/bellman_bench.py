@@ -0,0 +1,97 @@
+"""
+CPSC 5520, Seattle University
+Assignment Name: Pub/Sub Assignment
+Author: Rupeshwar Rao
+
+Benchmark of BellmanFord.shortest_paths on forex-like graphs of 5, 50 and 500
+currencies. Each currency trades against MARKETS_PER_CURRENCY others (every
+other one, for small graphs) in both directions, with edge weights -log(rate)
+and rates that all lose a small spread, so there is no arbitrage. The original
+nested-dict relaxation makes all of its passes on such a graph, while
+shortest_paths stops after the first pass that relaxes nothing (the passes
+column). Compares the two and, if numpy is installed,
+shortest_paths_vectorized.
+
+Usage: python bellman_bench.py [SECONDS_PER_CASE] [CURRENCIES ...]
+"""
+import math
+import random
+import sys
+import time
+
+from bellman_ford import BellmanFord, np
+
+MARKETS_PER_CURRENCY = 10
+SPREAD = 0.001
+
+
+def make_graph(n, rng):
+    values = [rng.uniform(0.01, 100.0) for _ in range(n)]
+    names = ['C{:03}'.format(i) for i in range(n)]
+    graph = BellmanFord()
+    for i in range(n):
+        partners = [j for j in range(n) if j != i]
+        for j in rng.sample(partners, min(len(partners), MARKETS_PER_CURRENCY)):
+            for u, v in ((i, j), (j, i)):
+                graph.add_edge(names[u], names[v], -math.log(values[v] / values[u] * (1 - SPREAD)))
+    return graph
+
+
+def shortest_paths_dicts(graph, start_vertex, tolerance=0):
+    """BellmanFord.shortest_paths as it was, relaxing straight from the nested dicts."""
+    distance, predecessor = {}, {}
+    for v in graph.vertices:
+        distance[v] = float('inf')
+        predecessor[v] = None
+    distance[start_vertex] = 0
+    for i in range(len(graph.vertices)):
+        for u in graph.edges:
+            for v in graph.edges[u]:
+                w = graph.edges[u][v]
+                if distance[v] - (distance[u] + w) > tolerance:
+                    if v == start_vertex:
+                        return distance, predecessor, (u, v)
+                    distance[v] = distance[u] + w
+                    predecessor[v] = u
+    for u in graph.edges:
+        for v in graph.edges[u]:
+            w = graph.edges[u][v]
+            if distance[v] - (distance[u] + w) > tolerance:
+                return distance, predecessor, (u, v)
+    return distance, predecessor, None
+
+
+def seconds_per_call(fn, seconds):
+    """Mean seconds per call of fn, over about seconds (and at least one call)."""
+    calls = 0
+    started = time.perf_counter()
+    while calls == 0 or time.perf_counter() - started < seconds:
+        fn()
+        calls += 1
+    return (time.perf_counter() - started) / calls
+
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    sizes = [int(arg) for arg in sys.argv[2:]] or [5, 50, 500]
+    rng = random.Random(5520)
+    print('{:>10} {:>7} {:>7} {:>12} {:>12} {:>8} {:>12} {:>8}'.format(
+        'currencies', 'edges', 'passes', 'dicts ms', 'arrays ms', 'speedup', 'numpy ms', 'speedup'))
+    for n in sizes:
+        graph = make_graph(n, rng)
+        start = 'C000'
+        expected = shortest_paths_dicts(graph, start)
+        assert graph.shortest_paths(start) == expected
+        base = seconds_per_call(lambda: shortest_paths_dicts(graph, start), seconds)
+        arrays = seconds_per_call(lambda: graph.shortest_paths(start), seconds)
+        row = [n, sum(len(graph.edges[u]) for u in graph.edges), graph.last_run['passes'],
+               base * 1000, arrays * 1000, base / arrays]
+        if np is not None:
+            vectorized = graph.shortest_paths_vectorized(start)
+            assert vectorized[2] is None and all(math.isclose(vectorized[0][v], expected[0][v], abs_tol=1e-9)
+                                                 for v in expected[0])
+            fast = seconds_per_call(lambda: graph.shortest_paths_vectorized(start), seconds)
+            row += [fast * 1000, base / fast]
+            print('{:>10} {:>7} {:>7} {:>12.3f} {:>12.3f} {:>7.1f}x {:>12.3f} {:>7.1f}x'.format(*row))
+        else:
+            print('{:>10} {:>7} {:>7} {:>12.3f} {:>12.3f} {:>7.1f}x {:>12} {:>8}'.format(*row, 'n/a', ''))
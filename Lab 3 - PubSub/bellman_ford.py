@@ -6,6 +6,73 @@ This is free and unencumbered software released into the public domain.
 
 Implementation of Bellman-Ford Algorithm for Lab 3.
 """
+from array import array
+import time
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:  # shortest_paths_vectorized needs numpy, everything else works without it
+    np = None
+
+
+class EdgeArrays(object):
+    """
+    A BellmanFord graph's edges with its vertices numbered once, so relaxation
+    indexes lists instead of hashing vertex names.
+
+    vertices[i] is vertex i and index[vertex] is i. rows has one
+    (u, targets, weights) per vertex with out-edges, in the order of
+    BellmanFord.edges, where targets and weights are parallel lists of vertex
+    numbers and edge weights (lists iterate fastest from Python and keep the
+    weights' own types, so sums come out exactly as with the dicts). The same
+    edges, in the same order, are also in the flat parallel arrays sources,
+    destinations and weights, for numpy to view without copying.
+    """
+
+    def __init__(self, vertices, edges):
+        self.vertices = list(vertices)
+        self.index = {v: i for i, v in enumerate(self.vertices)}
+        self.rows = []
+        self.sources, self.destinations, self.weights = array('l'), array('l'), array('d')
+        self.position = {}  # (from_vertex, to_vertex) -> (row weights, offset in row, offset in flat arrays)
+        for u in edges:
+            i = self.index[u]
+            targets, weights = [], []
+            for v, w in edges[u].items():
+                self.position[u, v] = (weights, len(weights), len(self.weights))
+                targets.append(self.index[v])
+                weights.append(w)
+                self.sources.append(i)
+                self.destinations.append(self.index[v])
+                self.weights.append(w)
+            self.rows.append((i, targets, weights))
+
+    def set_weight(self, from_vertex, to_vertex, weight):
+        """
+        Change the weight of an edge in place.
+        :return: False if there is no such edge (the arrays need rebuilding)
+        """
+        try:
+            weights, k, j = self.position[from_vertex, to_vertex]
+        except KeyError:
+            return False
+        weights[k] = weight
+        self.weights[j] = weight
+        return True
+
+    def result(self, start_vertex, distance, predecessor, negative_cycle):
+        """
+        Translate labels indexed by vertex number back into shortest_paths' dictionaries.
+        """
+        vertices = self.vertices
+        distance = dict(zip(vertices, distance))
+        predecessor = {v: None if u is None else vertices[u] for v, u in zip(vertices, predecessor)}
+        if start_vertex not in self.index:
+            distance[start_vertex] = 0
+        if negative_cycle is not None:
+            negative_cycle = (vertices[negative_cycle[0]], vertices[negative_cycle[1]])
+        return distance, predecessor, negative_cycle
 
 
 class BellmanFord(object):
@@ -18,6 +85,10 @@ class BellmanFord(object):
     def __init__(self, initial_edges=None):
         self.vertices = set()
         self.edges = {}
+        self.arrays = None  # EdgeArrays for shortest_paths, built when first needed
+        self.last_run = None  # instrumentation of the latest shortest_paths* call, see record()
+        self.runs = self.passes = self.relaxations = 0  # totals over all calls
+        self.seconds = 0.0
         if initial_edges is not None:
             for u in initial_edges:
                 for v in initial_edges[u]:
@@ -40,12 +111,15 @@ class BellmanFord(object):
         if from_vertex not in self.edges:
             self.edges[from_vertex] = {}
         self.edges[from_vertex][to_vertex] = weight
+        if self.arrays is not None and not self.arrays.set_weight(from_vertex, to_vertex, weight):
+            self.arrays = None
 
     def remove_edge(self, from_vertex, to_vertex):
         try:
             del self.edges[from_vertex][to_vertex]
         except KeyError:
             raise KeyError('remove_edge({}, {})'.format(from_vertex, to_vertex))
+        self.arrays = None
 
     def shortest_paths(self, start_vertex, tolerance=0):
         """
@@ -53,6 +127,11 @@ class BellmanFord(object):
         every other vertex. Also detect if there are negative cycles and
         report one of them. Edges may be negative.
 
+        Relaxation stops after the first pass that relaxes nothing: the
+        distances can no longer change, so there is no negative cycle
+        reachable from start_vertex. Each call is instrumented in last_run
+        (see record).
+
         For relaxation and cycle detection, we use tolerance. Only
         relaxations resulting in an improvement greater than tolerance are
         considered. For negative cycle detection, if the sum of weights is
@@ -71,6 +150,9 @@ class BellmanFord(object):
         >>> dist, prev, neg_edge = g.shortest_paths('a')
         >>> neg_edge  # edge where we noticed a negative cycle
         ('e', 'a')
+        >>> g.remove_edge('a', 'e')
+        >>> g.shortest_paths('a')[2] is None, g.last_run['passes'], g.last_run['relaxations']  # not 5 passes
+        (True, 2, 4)
 
         :param start_vertex: start of all paths
         :param tolerance: only if a path is more than tolerance better will
@@ -83,30 +165,283 @@ class BellmanFord(object):
             negative_cycle: None if no negative cycle, otherwise an edge,
                             (u,v), in one such cycle
         """
-        # initialize
-        distance, predecessor = {}, {}
-        for v in self.vertices:
-            distance[v] = float('inf')
-            predecessor[v] = None
-        distance[start_vertex] = 0
-
-        # repeated relaxation
-        for i in range(len(self.vertices)):
-            for u in self.edges:
-                for v in self.edges[u]:
-                    w = self.edges[u][v]
-                    if distance[v] - (distance[u] + w) > tolerance:
-                        if v == start_vertex:
-                            return distance, predecessor, (u, v)
-                        distance[v] = distance[u] + w
+        started = time.perf_counter()
+        arrays = self.compile()
+        distance, predecessor, negative_cycle, passes, relaxations = self.relax_from(
+            arrays, arrays.index.get(start_vertex), tolerance)
+        self.record(passes, relaxations, started, negative_cycle is not None)
+        return arrays.result(start_vertex, distance, predecessor, negative_cycle)
+
+    @staticmethod
+    def relax_from(arrays, start, tolerance):
+        """
+        The relaxation behind shortest_paths, on vertex numbers.
+
+        :param arrays: EdgeArrays of the graph
+        :param start: number of the start vertex, or None if it has no edges
+        :return: (distance, predecessor, negative_cycle, passes, relaxations),
+                 distance and predecessor lists indexed by vertex number and
+                 negative_cycle None or an edge (u, v) of vertex numbers
+        """
+        n = len(arrays.vertices)
+        inf = float('inf')
+        distance, predecessor = [inf] * n, [None] * n
+        if start is not None:
+            distance[start] = 0
+        passes = relaxations = 0
+
+        # repeated relaxation; a vertex still at inf cannot relax anything, so its row is skipped
+        for i in range(n):
+            passes += 1
+            relaxed = relaxations
+            for u, targets, weights in arrays.rows:
+                du = distance[u]
+                if du == inf:
+                    continue
+                for v, w in zip(targets, weights):
+                    if distance[v] - (du + w) > tolerance:
+                        if v == start:
+                            return distance, predecessor, (u, v), passes, relaxations
+                        distance[v] = du + w
                         predecessor[v] = u
+                        relaxations += 1
+            if relaxations == relaxed:
+                return distance, predecessor, None, passes, relaxations
 
         # check for negative cycles
-        negative_cycle = None
-        for u in self.edges:
-            for v in self.edges[u]:
-                w = self.edges[u][v]
-                if distance[v] - (distance[u] + w) > tolerance:
-                    return distance, predecessor, (u, v)
-
-        return distance, predecessor, None
+        for u, targets, weights in arrays.rows:
+            du = distance[u]
+            if du == inf:
+                continue
+            for v, w in zip(targets, weights):
+                if distance[v] - (du + w) > tolerance:
+                    return distance, predecessor, (u, v), passes, relaxations
+
+        return distance, predecessor, None, passes, relaxations
+
+    def negative_cycles(self, tolerance=0):
+        """
+        Find distinct negative cycles wherever they are in the graph, most
+        negative first.
+
+        First relaxes as shortest_paths would from a virtual source with an
+        edge of weight 0 to every vertex (so every distance starts at 0 and
+        every cycle is reachable). After each pass that relaxes something,
+        each cycle in the predecessor graph is followed and kept if its
+        weights sum to less than -tolerance; one closing pass after the usual
+        len(vertices) makes sure every cycle still relaxing shows up. Cycles
+        that share vertices cannot all be in one predecessor graph, so then
+        shortest_paths is run from each vertex of each cycle found, and the
+        cycle it detects followed back, until that turns up no new vertex to
+        start from. This finds the cycles near the ones the virtual source
+        run found, but not necessarily every negative cycle (there can be
+        exponentially many), nor for certain the most negative one.
+
+        >>> g = BellmanFord({'a': {'b': 1}, 'b': {'a': -2}, 'c': {'d': 1}, 'd': {'c': -5}, 'e': {'a': 1}})
+        >>> [(sorted(set(cycle)), weight) for cycle, weight in g.negative_cycles()]
+        [(['c', 'd'], -4), (['a', 'b'], -1)]
+        >>> cycle, weight = g.negative_cycles()[0]
+        >>> cycle[0] == cycle[-1], len(cycle)
+        (True, 3)
+        >>> g.add_edge('b', 'a', 0)
+        >>> g.add_edge('d', 'c', 1)
+        >>> g.negative_cycles()
+        []
+
+        :param tolerance: only if a path is more than tolerance better will
+                          it be relaxed, as for shortest_paths
+        :return: list of (cycle, weight) sorted by weight, cycle being the
+                 list of vertices [v0, v1, ..., v0] in the order of the edges
+                 and weight their sum
+        """
+        started = time.perf_counter()
+        arrays = self.compile()
+        n = len(arrays.vertices)
+        distance, predecessor = [0] * n, [None] * n
+        passes = relaxations = 0
+        cycles = {}  # cycle rotated to start at its lowest vertex number -> (cycle, weight)
+        for i in range(n + 1):
+            passes += 1
+            relaxed = relaxations
+            for u, targets, weights in arrays.rows:
+                du = distance[u]
+                for v, w in zip(targets, weights):
+                    if distance[v] - (du + w) > tolerance:
+                        distance[v] = du + w
+                        predecessor[v] = u
+                        relaxations += 1
+            if relaxations == relaxed:
+                break
+            self.collect_cycles(arrays, predecessor, tolerance, cycles)
+
+        # start again from every vertex on a cycle, for the overlapping cycles
+        tried = set()
+        starts = deque(u for key in cycles for u in key)
+        while starts:
+            start = starts.popleft()
+            if start in tried:
+                continue
+            tried.add(start)
+            distance, predecessor, edge, more_passes, more_relaxations = self.relax_from(arrays, start, tolerance)
+            passes += more_passes
+            relaxations += more_relaxations
+            if edge is None:
+                continue
+            loop = self.follow_cycle(predecessor, edge)
+            if loop is not None and self.add_cycle(arrays, loop, tolerance, cycles):
+                starts.extend(loop)
+        self.record(passes, relaxations, started, bool(cycles))
+        return sorted(cycles.values(), key=lambda found: found[1])
+
+    @staticmethod
+    def follow_cycle(predecessor, edge):
+        """
+        Follow the predecessors back from an edge that still relaxes to the
+        negative cycle it is on or leads from: n steps back are sure to be on it.
+
+        :return: the cycle's vertex numbers in the order of the edges, or None
+                 if the predecessors run out first
+        """
+        predecessor = list(predecessor)
+        u, v = edge
+        predecessor[v] = u
+        for i in range(len(predecessor)):
+            v = predecessor[v]
+            if v is None:
+                return None
+        loop = [v]
+        u = predecessor[v]
+        while u != v:
+            loop.append(u)
+            u = predecessor[u]
+        loop.reverse()  # predecessors run against the edges
+        return loop
+
+    def add_cycle(self, arrays, loop, tolerance, cycles):
+        """
+        Add a cycle of vertex numbers to cycles, keyed by its rotation that
+        starts at the lowest number, if it is new and weighs less than -tolerance.
+        :return: whether it was added
+        """
+        lowest = loop.index(min(loop))
+        key = tuple(loop[lowest:] + loop[:lowest])
+        if key in cycles:
+            return False
+        cycle = [arrays.vertices[u] for u in key] + [arrays.vertices[key[0]]]
+        weight = sum(self.edges[cycle[k]][cycle[k + 1]] for k in range(len(key)))
+        if weight >= -tolerance:
+            return False
+        cycles[key] = (cycle, weight)
+        return True
+
+    def collect_cycles(self, arrays, predecessor, tolerance, cycles):
+        """
+        Add each cycle of the predecessor graph (every vertex has at most one
+        predecessor, so following them from each vertex in turn finds them all)
+        to cycles, see add_cycle.
+        """
+        state = [0] * len(predecessor)  # 0: not seen yet, 1: on the current walk, 2: done
+        for s in range(len(predecessor)):
+            walk = []
+            v = s
+            while v is not None and state[v] == 0:
+                state[v] = 1
+                walk.append(v)
+                v = predecessor[v]
+            if v is not None and state[v] == 1:
+                loop = walk[walk.index(v):]
+                loop.reverse()  # predecessors run against the edges
+                self.add_cycle(arrays, loop, tolerance, cycles)
+            for u in walk:
+                state[u] = 2
+
+    def shortest_paths_vectorized(self, start_vertex, tolerance=0):
+        """
+        Same as shortest_paths, but each pass relaxes the whole edge list at
+        once with numpy. The passes relax in rounds (every edge sees the
+        distances of the previous pass) rather than one edge after the other,
+        so the distances are the same but, where shortest paths tie, the
+        predecessor may be another one, and with negative cycles the edge
+        reported may be another edge on one. Distances are floats.
+
+        :raises ImportError: if numpy is not installed
+        """
+        if np is None:
+            raise ImportError('shortest_paths_vectorized needs numpy')
+        started = time.perf_counter()
+        arrays = self.compile()
+        n = len(arrays.vertices)
+        passes = relaxations = 0
+        sources, destinations, weights = (np.asarray(a) for a in (arrays.sources, arrays.destinations, arrays.weights))
+        distance = np.full(n, np.inf)
+        predecessor = np.full(n, -1)
+        start = arrays.index.get(start_vertex, -1)
+        if start >= 0:
+            distance[start] = 0
+
+        def result(negative_cycle):
+            self.record(passes, relaxations, started, negative_cycle is not None)
+            return arrays.result(start_vertex, distance.tolist(),
+                                 [None if u < 0 else u for u in predecessor.tolist()], negative_cycle)
+
+        with np.errstate(invalid='ignore'):  # inf - inf where neither end has been reached
+            for i in range(n):
+                passes += 1
+                candidate = distance[sources] + weights
+                better = np.flatnonzero(distance[destinations] - candidate > tolerance)
+                if not len(better):
+                    return result(None)
+                relaxations += len(better)
+                into_start = better[destinations[better] == start]
+                if len(into_start):
+                    return result((int(sources[into_start[0]]), start))
+                relaxed = distance.copy()
+                np.minimum.at(relaxed, destinations[better], candidate[better])
+                best = better[candidate[better] == relaxed[destinations[better]]]
+                predecessor[destinations[best]] = sources[best]
+                distance = relaxed
+
+            # check for negative cycles
+            better = np.flatnonzero(distance[destinations] - (distance[sources] + weights) > tolerance)
+        if len(better):
+            return result((int(sources[better[0]]), int(destinations[better[0]])))
+        return result(None)
+
+    def record(self, passes, relaxations, started, negative_cycle):
+        """
+        Keep the instrumentation of a shortest_paths* call in last_run and add it to the totals.
+
+        last_run is a dict of:
+            passes:         full relaxation passes made
+            relaxations:    distance labels lowered
+            seconds:        time in the call, i.e. spent looking for a negative cycle
+            negative_cycle: whether one was found
+        """
+        seconds = time.perf_counter() - started
+        self.last_run = {'passes': passes, 'relaxations': relaxations, 'seconds': seconds,
+                         'negative_cycle': negative_cycle}
+        self.runs += 1
+        self.passes += passes
+        self.relaxations += relaxations
+        self.seconds += seconds
+
+    def metrics(self):
+        """
+        Totals over every shortest_paths* call on this graph, and the latest call.
+        """
+        return {
+            'runs': self.runs,
+            'passes': self.passes,
+            'relaxations': self.relaxations,
+            'seconds': self.seconds,
+            'passes_per_run': self.passes / self.runs if self.runs else None,
+            'last_run': self.last_run,
+        }
+
+    def compile(self):
+        """
+        Get the EdgeArrays for this graph, building them if edges were added or removed since.
+        """
+        if self.arrays is None:
+            self.arrays = EdgeArrays(self.vertices, self.edges)
+        return self.arrays
@@ -4,18 +4,26 @@ Forex Provider
 
 This module implements a staging version the Forex Provider price feed on localhost.
 """
+import asyncio
+import heapq
 import socket
 import selectors
+import sys
+from collections import deque
 from datetime import datetime, timedelta
 import time
 import random
 import fxp_bytes
+from fxp_fanout import DatagramFanout
 
 
 REQUEST_ADDRESS = ('localhost', 50403)
 REQUEST_SIZE = 12
 REVERSE_QUOTED = {'GBP', 'EUR', 'AUD'}
 SUBSCRIPTION_TIME = 19  # 10 * 60  # seconds
+PUBLISH_INTERVAL = 1.0  # seconds between ticks
+REPORT_TICKS = 10  # ticks between the asyncio engine's timing reports
+PRINT_SUBSCRIBERS_MAX = 10  # above this many subscribers, publish prints a summary instead of a line each
 
 
 class TestPublisher(object):
@@ -23,15 +31,88 @@ class TestPublisher(object):
     Publishes occasional messages
     Updated to ensure 4-way cycle markets are always in same order
       e.g.  always CAD/EUR, not sometimes EUR/CAD
+
+    Subscriptions are also kept in a min-heap by expiry time, so each tick only looks at the
+    subscriptions that have actually expired. A renewal pushes a new entry and leaves the old
+    one in the heap; it is recognised as stale (its expiry no longer matches) when it comes up.
+
+    >>> publisher = TestPublisher()
+    >>> publisher.register_subscription(('127.0.0.1', 5000), now=0.0)
+    registering subscription for ('127.0.0.1', 5000)
+    >>> publisher.register_subscription(('127.0.0.1', 5001), now=0.0)
+    registering subscription for ('127.0.0.1', 5001)
+    >>> publisher.register_subscription(('127.0.0.1', 5000), now=10.0)  # renewed
+    registering subscription for ('127.0.0.1', 5000)
+    >>> publisher.expire_subscriptions(now=SUBSCRIPTION_TIME)
+    ('127.0.0.1', 5001) subscription expired
+    1
+    >>> metrics = publisher.metrics()
+    >>> metrics['subscriptions'], metrics['renewals'], metrics['expired'], metrics['stale_entries']
+    (1, 1, 1, 1)
     """
     def __init__(self):
-        self.subscriptions = {}
+        self.subscriptions = {}  # expiry time (time.monotonic) indexed by subscriber
+        self.expiry_heap = []  # (expiry time, subscriber), may hold stale entries for renewed subscriptions
+        self.registrations = 0
+        self.renewals = 0
+        self.expired = 0
+        self.stale_entries = 0
+        self.expire_seconds = 0.0  # time spent in expire_subscriptions
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.fanout = DatagramFanout(self.socket)
         self.reference = {'GBP': 1.25, 'JPY': 100.0, 'EUR': 1.10, 'CHF': 1.00, 'AUD': 0.75}
 
-    def register_subscription(self, subscriber):
+    def register_subscription(self, subscriber, now=None):
         print('registering subscription for {}'.format(subscriber))
-        self.subscriptions[subscriber] = datetime.utcnow()
+        if subscriber in self.subscriptions:
+            self.renewals += 1
+        else:
+            self.registrations += 1
+        expiry = (time.monotonic() if now is None else now) + SUBSCRIPTION_TIME
+        self.subscriptions[subscriber] = expiry
+        heapq.heappush(self.expiry_heap, (expiry, subscriber))
+        if len(self.expiry_heap) > 2 * len(self.subscriptions) + 64:
+            # mostly renewals' leftovers, rebuild from the live subscriptions
+            self.expiry_heap = [(expiry, subscriber) for subscriber, expiry in self.subscriptions.items()]
+            heapq.heapify(self.expiry_heap)
+
+    def expire_subscriptions(self, now=None):
+        """
+        Drop every subscription whose time is up.
+
+        :return: number of subscriptions dropped
+        """
+        started = time.perf_counter()
+        now = time.monotonic() if now is None else now
+        heap = self.expiry_heap
+        expired = 0
+        while heap and heap[0][0] <= now:
+            expiry, subscriber = heapq.heappop(heap)
+            if self.subscriptions.get(subscriber) != expiry:
+                self.stale_entries += 1  # renewed since this entry was pushed
+                continue
+            print('{} subscription expired'.format(subscriber))
+            del self.subscriptions[subscriber]
+            expired += 1
+        self.expired += expired
+        self.expire_seconds += time.perf_counter() - started
+        return expired
+
+    def metrics(self):
+        """
+        Subscription counts since this publisher started, and expiry throughput
+        (subscriptions expired per second spent in expire_subscriptions).
+        """
+        return {
+            'subscriptions': len(self.subscriptions),
+            'registrations': self.registrations,
+            'renewals': self.renewals,
+            'expired': self.expired,
+            'stale_entries': self.stale_entries,
+            'expiry_heap': len(self.expiry_heap),
+            'expire_seconds': self.expire_seconds,
+            'expired_per_second': self.expired / self.expire_seconds if self.expire_seconds else None,
+        }
 
     @staticmethod
     # ensure market names always in correct order, alpha sort e.g. CAD/EUR
@@ -45,15 +126,33 @@ class TestPublisher(object):
         return "{}/{}".format(curr_first, curr_second)
 
     def publish(self):
+        quotes, message = self.next_message()
+        if message is None:
+            return 1000.0  # nothing to do until we get a subscription, so we can wait a long time
+
+        # send the messages to current subscribers, in as few syscalls as we can (see fxp_fanout)
+        if len(self.subscriptions) <= PRINT_SUBSCRIBERS_MAX:
+            for subscriber in self.subscriptions:
+                print('publishing {} to {}'.format(quotes, subscriber))
+        else:
+            print('publishing {} to {} subscribers'.format(quotes, len(self.subscriptions)))
+        self.fanout.send(message, self.subscriptions)
+
+        # pick a time to wait until the next message
+        return PUBLISH_INTERVAL  # FIXME randomize quiet time
+
+    def next_message(self):
+        """
+        Drop expired subscriptions and make this tick's quotes.
+
+        :return: (quotes, marshalled message), or (None, None) if there is no one to send them to
+        """
         # remove expired subscriptions
         ts = datetime.utcnow()
-        for subscriber in set(self.subscriptions):
-            if (ts - self.subscriptions[subscriber]).total_seconds() >= SUBSCRIPTION_TIME:
-                print('{} subscription expired'.format(subscriber))
-                del self.subscriptions[subscriber]
+        self.expire_subscriptions()
         if len(self.subscriptions) == 0:
             print('no subscriptions')
-            return 1000.0  # nothing to do until we get a subscription, so we can wait a long time
+            return None, None
 
         # random walk the prices
         quotes = []
@@ -93,14 +192,7 @@ class TestPublisher(object):
                 market_name = TestPublisher.format_market_order("CAD",yyy)
                 quotes.append({'cross': '{}'.format(market_name), 'price': rate*2})
 
-        # send the messages to current subscribers
-        message = fxp_bytes.marshal_message(quotes)
-        for subscriber in self.subscriptions:
-            print('publishing {} to {}'.format(quotes, subscriber))
-            self.socket.sendto(message, subscriber)
-
-        # pick a time to wait until the next message
-        return 1.0  # FIXME randomize quiet time
+        return quotes, fxp_bytes.marshal_message(quotes)
 
 
 class ForexProvider(object):
@@ -145,10 +237,148 @@ class ForexProvider(object):
         return listener
 
 
+class SubscriptionProtocol(asyncio.DatagramProtocol):
+    """
+    Hands each subscription request datagram to an AsyncForexProvider.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    def connection_made(self, transport):
+        self.provider.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.provider.register_subscription(data)
+
+
+class AsyncForexProvider(object):
+    """
+    asyncio engine for a publisher: subscription requests are taken by a DatagramProtocol as they
+    arrive, and the publisher's messages go out on a fixed tick schedule, to all subscribers at once.
+
+    Tick k is due at start + k * interval, so a late tick does not push back the ones after it.
+    Every report_every ticks it prints how late the ticks woke up (jitter) and how long sending
+    to all subscribers took.
+    """
+
+    def __init__(self, request_address, publisher_class, interval=PUBLISH_INTERVAL, report_every=REPORT_TICKS):
+        """
+        :param request_address: where subscription requests are received
+        :param publisher_class: publisher class must support next_message and register_subscription
+        :param interval: seconds between ticks
+        :param report_every: ticks between timing reports, None for no reports
+        """
+        self.request_address = request_address
+        self.publisher = publisher_class()
+        self.interval = interval
+        self.report_every = report_every
+        self.transport = None
+        self.subscribed = None  # asyncio.Event set whenever a subscription comes in
+        self.ticks = 0
+        self.jitter = deque(maxlen=1000)  # seconds each recent tick started after it was due
+        self.send_times = deque(maxlen=1000)  # seconds each recent tick spent sending
+        self.messages_sent = 0
+
+    def run_forever(self):
+        asyncio.run(self.run())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.subscribed = asyncio.Event()
+        await loop.create_datagram_endpoint(lambda: SubscriptionProtocol(self), local_addr=self.request_address)
+        print('waiting for subscribers on {}  - asyncio'.format(self.request_address))
+        try:
+            while True:
+                await self.subscribed.wait()
+                await self.publish_on_schedule(loop)
+        finally:
+            self.transport.close()
+
+    async def publish_on_schedule(self, loop):
+        """Publish every interval seconds until there is no one left to publish to."""
+        start = loop.time()
+        tick = 0
+        while True:
+            due = start + tick * self.interval
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.jitter.append(loop.time() - due)
+            if not self.publish():
+                self.subscribed.clear()
+                return
+            tick += 1
+            if loop.time() > start + tick * self.interval:
+                # we fell a whole tick behind, skip the missed ones rather than bursting to catch up
+                tick = int((loop.time() - start) // self.interval) + 1
+
+    def publish(self):
+        """
+        Send this tick's message to every subscriber, from the publisher's socket and in as few
+        syscalls as its DatagramFanout can (a publisher without a fanout gets one sendto each from
+        the subscription socket).
+
+        :return: False if there were no subscribers
+        """
+        quotes, message = self.publisher.next_message()
+        if message is None:
+            return False
+        started = time.perf_counter()
+        subscribers = list(self.publisher.subscriptions)
+        fanout = getattr(self.publisher, 'fanout', None)
+        if fanout is not None:
+            fanout.send(message, subscribers)
+        else:
+            for subscriber in subscribers:
+                self.transport.sendto(message, subscriber)
+        self.send_times.append(time.perf_counter() - started)
+        self.messages_sent += len(subscribers)
+        self.ticks += 1
+        print('published {} quotes to {} subscribers'.format(len(quotes), len(subscribers)))
+        if self.report_every and self.ticks % self.report_every == 0:
+            print(self.format_stats())
+        return True
+
+    def register_subscription(self, data):
+        subscriber = fxp_bytes.deserialize_address(data)
+        self.publisher.register_subscription(subscriber)
+        self.subscribed.set()
+
+    def stats(self):
+        """
+        Timing of recent ticks, in seconds.
+        """
+        jitter = sorted(self.jitter)
+        send_times = sorted(self.send_times)
+        return {
+            'ticks': self.ticks,
+            'messages_sent': self.messages_sent,
+            'subscribers': len(self.publisher.subscriptions),
+            'jitter_mean': sum(jitter) / len(jitter) if jitter else None,
+            'jitter_p99': jitter[int(len(jitter) * 0.99)] if jitter else None,
+            'jitter_max': jitter[-1] if jitter else None,
+            'send_time_mean': sum(send_times) / len(send_times) if send_times else None,
+            'send_time_max': send_times[-1] if send_times else None,
+            **(self.publisher.metrics() if hasattr(self.publisher, 'metrics') else {}),
+        }
+
+    def format_stats(self):
+        stats = self.stats()
+        return ('{ticks} ticks, {subscribers} subscribers: jitter mean {:.3f} ms p99 {:.3f} ms max {:.3f} ms, '
+                'send time mean {:.3f} ms max {:.3f} ms').format(
+            stats['jitter_mean'] * 1000, stats['jitter_p99'] * 1000, stats['jitter_max'] * 1000,
+            stats['send_time_mean'] * 1000, stats['send_time_max'] * 1000, **stats)
+
+
 if __name__ == '__main__':
     # if REQUEST_ADDRESS[1] == 50403:
     #     print('Pick your own port for testing!')
     #     print('Modify REQUEST_ADDRESS above to use localhost and some random port')
     #     exit(1)
-    fxp = ForexProvider(REQUEST_ADDRESS, TestPublisher)
+    # python forex_provider.py [--asyncio]
+    if '--asyncio' in sys.argv:
+        fxp = AsyncForexProvider(REQUEST_ADDRESS, TestPublisher)
+    else:
+        fxp = ForexProvider(REQUEST_ADDRESS, TestPublisher)
     fxp.run_forever()
@@ -5,11 +5,17 @@ Forex Provider
 This module contains useful marshalling functions for manipulating Forex Provider packet contents.
 """
 import ipaddress
+import struct
+import time
 from array import array
 from datetime import datetime
 
 MAX_QUOTES_PER_MESSAGE = 50
 MICROS_PER_SECOND = 1_000_000
+EPOCH = datetime(1970, 1, 1)
+RECORD = struct.Struct('<6sf8s14x')  # both currencies, price, timestamp (big-endian, see MICROS), padding
+MICROS = struct.Struct('>Q')  # microseconds since EPOCH
+MARKETS = {}  # the 6 currency bytes of each cross seen so far
 
 
 def serialize_price(x: float) -> bytes:
@@ -88,16 +94,42 @@ def marshal_message(quote_sequence) -> bytes:
     """
     if len(quote_sequence) > MAX_QUOTES_PER_MESSAGE:
         raise ValueError('max quotes exceeded for a single message')
-    message = bytes()
-    default_time = serialize_utcdatetime(datetime.utcnow())
-    padding = b'\x00' * 14  # 10 bytes of zeros
+    buffer = bytearray(RECORD.size * len(quote_sequence))
+    marshal_message_into(quote_sequence, buffer)
+    return bytes(buffer)
+
+
+def marshal_message_into(quote_sequence, buffer, offset=0) -> int:
+    """
+    Pack the records for quote_sequence into buffer, starting at offset, as marshal_message lays them out.
+    A publisher can keep one buffer and send a memoryview of it, with no per-message allocation.
+
+    >>> buffer = bytearray(2 * RECORD.size)
+    >>> q1 = {'cross': 'GBP/USD', 'price': 1.22041, 'time': datetime(2006,1,2)}
+    >>> marshal_message_into([q1, q1], buffer)
+    64
+    >>> bytes(buffer) == marshal_message([q1, q1])
+    True
+
+    :param quote_sequence: list of quote structures ('cross' and 'price', may also have 'time')
+    :param buffer: writable buffer with room for RECORD.size bytes per quote after offset
+    :return: number of bytes written
+    """
+    default_time = None
+    pack_into = RECORD.pack_into
     for quote in quote_sequence:
-        message += quote['cross'][0:3].encode('ascii')
-        message += quote['cross'][4:7].encode('ascii')
-        message += serialize_price(quote['price'])
+        cross = quote['cross']
+        market = MARKETS.get(cross)
+        if market is None:
+            market = cross[0:3].encode('ascii') + cross[4:7].encode('ascii')
+            if len(MARKETS) < 1024:
+                MARKETS[cross] = market
         if 'time' in quote:
-            message += serialize_utcdatetime(quote['time'])
+            timestamp = MICROS.pack(int((quote['time'] - EPOCH).total_seconds() * MICROS_PER_SECOND))
         else:
-            message += default_time
-        message += padding
-    return message
+            if default_time is None:
+                default_time = MICROS.pack(time.time_ns() // 1000)
+            timestamp = default_time
+        pack_into(buffer, offset, market, quote['price'], timestamp)
+        offset += RECORD.size
+    return RECORD.size * len(quote_sequence)
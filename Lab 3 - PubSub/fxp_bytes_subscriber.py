@@ -5,9 +5,27 @@ Author: Rupeshwar Rao
 """
 
 import struct
+import sys
 from datetime import datetime, timedelta
 
+try:
+    import numpy as np
+except ImportError:  # parse_message_array needs numpy, everything else works without it
+    np = None
+
 MICROS_PER_SECOND = 1_000_000
+RECORD_SIZE = 32
+RECORD_DTYPE = None if np is None else np.dtype([
+    ('currency1', 'S3'),
+    ('currency2', 'S3'),
+    ('rate', '<f4'),
+    ('micros', '>u8'),  # microseconds since 1970-01-01 UTC
+    ('padding', 'V14'),
+])
+QUOTE = struct.Struct('<6sf22x')  # both currency codes and the rate of one record
+QUOTE_MICROS = struct.Struct('>10xQ14x')  # the timestamp of the same record
+EPOCH = datetime(1970, 1, 1)
+MARKETS = {}  # interned (currency1, currency2) indexed by the 6 code bytes
 
 
 def deserialize_price(b: bytes) -> float:
@@ -26,6 +44,49 @@ def deserialize_utcdatetime(b: bytes) -> datetime:
     return epoch + timedelta(microseconds=micros)
 
 
+def format_micros(micros: int) -> str:
+    """
+    Format microseconds since 1970-01-01 UTC for printing.
+
+    >>> format_micros(1136160000000001)
+    '2006-01-02 00:00:00.000001'
+    """
+    return (EPOCH + timedelta(microseconds=micros)).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def intern_market(code: bytes) -> tuple:
+    """
+    The (currency1, currency2) tuple for 6 bytes of currency codes, the same tuple every time.
+    """
+    market = MARKETS.get(code)
+    if market is None:
+        market = (sys.intern(code[:3].decode('ascii')), sys.intern(code[3:].decode('ascii')))
+        if len(MARKETS) < 4096:
+            MARKETS[bytes(code)] = market
+    return market
+
+
+def parse_quotes(message) -> list:
+    """
+    Parse the received message into (market, rate, micros) tuples, faster than parse_message.
+    The records are unpacked by two precompiled structs stepping over the same memoryview,
+    market is an interned (currency1, currency2) tuple shared by every quote for that market,
+    and micros is the timestamp as an integer number of microseconds since 1970-01-01 UTC.
+
+    >>> import fxp_bytes
+    >>> message = fxp_bytes.marshal_message([{'cross': 'GBP/USD', 'price': 1.25, 'time': datetime(2006, 1, 2)}])
+    >>> parse_quotes(message + message)
+    [(('GBP', 'USD'), 1.25, 1136160000000000), (('GBP', 'USD'), 1.25, 1136160000000000)]
+    >>> parse_quotes(message)[0][0] is parse_quotes(message)[0][0]
+    True
+    """
+    view = memoryview(message)
+    view = view[:len(view) - len(view) % RECORD_SIZE]
+    markets = MARKETS
+    return [(markets.get(code) or intern_market(code), rate, micros)
+            for (code, rate), (micros,) in zip(QUOTE.iter_unpack(view), QUOTE_MICROS.iter_unpack(view))]
+
+
 def parse_message(message: bytes) -> list:
     """
     Parse the received message and return a list of quotes.
@@ -50,4 +111,27 @@ def parse_message(message: bytes) -> list:
             'rate': rate,
             'timestamp': timestamp
         })
-    return quotes
\ No newline at end of file
+    return quotes
+
+
+def parse_message_array(message) -> dict:
+    """
+    Parse the received message into columns instead of a list of quotes.
+
+    The message is viewed in place as a NumPy structured array of RECORD_DTYPE, so no record
+    is copied or decoded one at a time. The result holds the columns as views of that array:
+    - 'currency1', 'currency2': 3-byte ASCII codes (numpy bytes, e.g. b'GBP')
+    - 'rate': little-endian float32 prices
+    - 'micros': big-endian uint64 microseconds since 1970-01-01 UTC
+    so staleness checks and graph updates can work on whole columns, e.g.
+    columns['micros'] > cutoff, or -np.log(columns['rate']) for all edge weights at once.
+    Like parse_message, trailing bytes short of a whole record are ignored.
+
+    :param message: the datagram (bytes, bytearray or memoryview)
+    :return: dict of column name to numpy array, all of the same length
+    :raises ImportError: if numpy is not installed
+    """
+    if np is None:
+        raise ImportError('parse_message_array needs numpy')
+    records = np.frombuffer(message, dtype=RECORD_DTYPE, count=len(message) // RECORD_SIZE)
+    return {name: records[name] for name in ('currency1', 'currency2', 'rate', 'micros')}
@@ -0,0 +1,137 @@
+"""
+Forex Provider
+(c) all rights reserved
+
+This module sends one datagram to many subscribers with as few system calls as possible.
+On Linux it calls sendmmsg(2) through ctypes, which hands the kernel up to MAX_BATCH
+(destination, message) pairs per call. Elsewhere, or if libc has no sendmmsg, it falls
+back to one sendto per subscriber.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import struct
+import sys
+
+MAX_BATCH = 1024  # UIO_MAXIOV, the most messages one sendmmsg call accepts
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(iovec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr), ('msg_len', ctypes.c_uint)]
+
+
+def load_sendmmsg():
+    """
+    Get libc's sendmmsg, or None if this platform does not have it.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]  # the mmsghdr array
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+SENDMMSG = load_sendmmsg()
+
+
+def serialize_sockaddr(address: (str, int)) -> bytes:
+    """
+    Build a struct sockaddr_in for an IPv4 (host, port) pair.
+
+    >>> serialize_sockaddr(('127.0.0.1', 65534))[2:8]
+    b'\\xff\\xfe\\x7f\\x00\\x00\\x01'
+
+    :param address: ip address and port pair
+    :return: 16 bytes, family in native byte order, port and address in network byte order
+    """
+    return struct.pack('=H', socket.AF_INET) + struct.pack('!H', address[1]) + socket.inet_aton(address[0]) + bytes(8)
+
+
+class DatagramFanout(object):
+    """
+    Sends the same message to every subscriber through one UDP socket.
+
+    The sendmmsg headers (one per subscriber, all pointing at the same message) are built once
+    and reused until the set of subscribers changes, so a tick costs a handful of system calls
+    and no per-subscriber Python work.
+    """
+
+    def __init__(self, sock, use_sendmmsg=None):
+        """
+        :param sock: UDP socket to send from
+        :param use_sendmmsg: False to always use the sendto loop; by default use sendmmsg where available
+        """
+        self.sock = sock
+        self.use_sendmmsg = SENDMMSG is not None if use_sendmmsg is None else use_sendmmsg and SENDMMSG is not None
+        self.subscribers = None  # subscribers the headers below were built for
+        self.names = None
+        self.headers = None
+        self.iov = iovec()
+        self.syscalls = 0
+
+    def send(self, message: bytes, subscribers) -> int:
+        """
+        Send message to each (host, port) in subscribers.
+
+        :return: number of datagrams sent
+        :raises OSError: as sendto would, for the first subscriber the kernel refuses
+        """
+        if not self.use_sendmmsg:
+            for subscriber in subscribers:
+                self.sock.sendto(message, subscriber)
+            self.syscalls += len(subscribers)
+            return len(subscribers)
+
+        subscribers = tuple(subscribers)
+        if subscribers != self.subscribers:
+            self.prepare(subscribers)
+        buffer = ctypes.create_string_buffer(message, len(message))
+        self.iov.iov_base = ctypes.addressof(buffer)
+        self.iov.iov_len = len(message)
+        fd = self.sock.fileno()
+        sent = 0
+        while sent < len(subscribers):
+            batch = min(len(subscribers) - sent, MAX_BATCH)
+            result = SENDMMSG(fd, ctypes.addressof(self.headers) + sent * ctypes.sizeof(mmsghdr), batch, 0)
+            self.syscalls += 1
+            if result < 0:
+                err = ctypes.get_errno()
+                if err == errno.EINTR:
+                    continue
+                raise OSError(err, os.strerror(err))
+            sent += result
+        return sent
+
+    def prepare(self, subscribers):
+        """
+        Build the sockaddr and mmsghdr arrays for subscribers.
+        """
+        names = b''.join(serialize_sockaddr(subscriber) for subscriber in subscribers)
+        self.names = ctypes.create_string_buffer(names, len(names))
+        self.headers = (mmsghdr * len(subscribers))()
+        base = ctypes.addressof(self.names)
+        iov = ctypes.pointer(self.iov)
+        for i, header in enumerate(self.headers):
+            header.msg_hdr.msg_name = base + 16 * i
+            header.msg_hdr.msg_namelen = 16
+            header.msg_hdr.msg_iov = iov
+            header.msg_hdr.msg_iovlen = 1
+        self.subscribers = subscribers
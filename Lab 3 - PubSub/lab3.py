@@ -5,16 +5,20 @@ Author: Rupeshwar Rao
 """
 
 
+import heapq
 import socket
 import struct
+import sys
 import math
 import time
-from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
 
-from fxp_bytes_subscriber import parse_message
+from fxp_bytes_subscriber import parse_quotes, format_micros
 from bellman_ford import BellmanFord
+import arbitrage_scan
 
 MICROS_PER_SECOND = 1_000_000
+QUOTE_LIFETIME = int(1.5 * MICROS_PER_SECOND)  # microseconds a quote stays usable
 
 
 def get_local_ip():
@@ -50,53 +54,70 @@ def subscribe_to_forex(sock, provider_address, local_ip, port):
     print(f'Sent subscription request to {provider_address}')
 
 
-def handle_message(data, latest_timestamps, quotes):
+def handle_message(data, latest_timestamps, quotes, graph=None, edge_rates=None, expiry_heap=None):
     """
     Process the received message and update the quotes dictionary.
+    Timestamps are kept as integer microseconds since 1970-01-01 UTC and only formatted for printing.
 
     Args:
         data: The received data from the forex provider.
         latest_timestamps: A dictionary to track the latest timestamps for each currency pair.
         quotes: A dictionary to store the latest quotes for currency pairs.
+        graph, edge_rates: If given, the long-lived graph and rates (see create_graph), whose
+            edges for each new quote are updated in place.
+        expiry_heap: If given, a heap of (expiration, market_pair) that each new quote is pushed on,
+            for remove_expired_quotes.
     """
-    quotes_list = parse_message(data)
-    for quote in quotes_list:
-        currency_from = quote['currency1']
-        currency_to = quote['currency2']
-        exchange_rate = quote['rate']
-        timestamp = quote['timestamp']
-        market_pair = (currency_from, currency_to)
-        timestamp_str = timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')
+    for market_pair, exchange_rate, timestamp in parse_quotes(data):
+        currency_from, currency_to = market_pair
 
         if market_pair in latest_timestamps:
             if timestamp <= latest_timestamps[market_pair]:
-                print(f'{timestamp_str} {currency_from} {currency_to} {exchange_rate}')
+                print(f'{format_micros(timestamp)} {currency_from} {currency_to} {exchange_rate}')
                 print('Ignoring out-of-sequence message')
                 continue
 
         latest_timestamps[market_pair] = timestamp
-        expiration_time = timestamp + timedelta(seconds=1.5)
+        expiration_time = timestamp + QUOTE_LIFETIME
         quotes[market_pair] = {'rate': exchange_rate, 'timestamp': timestamp, 'expiration': expiration_time}
-        print(f'{timestamp_str} {currency_from} {currency_to} {exchange_rate}')
+        if graph is not None:
+            update_market(graph, edge_rates, market_pair, exchange_rate)
+        if expiry_heap is not None:
+            heapq.heappush(expiry_heap, (expiration_time, market_pair))
+        print(f'{format_micros(timestamp)} {currency_from} {currency_to} {exchange_rate}')
 
 
-def remove_expired_quotes(quotes):
+def remove_expired_quotes(quotes, graph=None, edge_rates=None, expiry_heap=None):
     """
     Remove expired quotes from the quotes dictionary.
 
     Args:
         quotes: A dictionary containing the latest quotes for currency pairs.
+        graph, edge_rates: If given, the long-lived graph and rates, whose edges for each
+            expired quote are removed (see remove_market).
+        expiry_heap: If given, the heap handle_message pushed each quote's expiration on. Only
+            the quotes due are popped, instead of checking every quote; an entry for a quote
+            that was renewed since no longer matches its expiration and is dropped.
     """
-    current_time = datetime.utcnow()
+    current_time = time.time_ns() // 1000  # microseconds, like the quotes' timestamps
     expired_markets = []
 
-    for market_pair in quotes:
-        expiration_time = quotes[market_pair]['expiration']
-        if current_time > expiration_time:
-            expired_markets.append(market_pair)
+    if expiry_heap is None:
+        for market_pair in quotes:
+            expiration_time = quotes[market_pair]['expiration']
+            if current_time > expiration_time:
+                expired_markets.append(market_pair)
+    else:
+        while expiry_heap and current_time > expiry_heap[0][0]:
+            expiration_time, market_pair = heapq.heappop(expiry_heap)
+            quote = quotes.get(market_pair)
+            if quote is not None and quote['expiration'] == expiration_time:
+                expired_markets.append(market_pair)
 
     for market_pair in expired_markets:
         del quotes[market_pair]
+        if graph is not None:
+            remove_market(graph, edge_rates, market_pair, quotes)
         print(f'Removing stale quote for {market_pair}')
 
 
@@ -114,22 +135,106 @@ def create_graph(quotes):
     edge_rates = {}
 
     for market_pair in quotes:
-        currency_from, currency_to = market_pair
-        exchange_rate = quotes[market_pair]['rate']
-        weight_forward = -math.log(exchange_rate)
-        graph.add_edge(currency_from, currency_to, weight_forward)
-        edge_rates[(currency_from, currency_to)] = exchange_rate
-
-        weight_reverse = math.log(exchange_rate)
-        graph.add_edge(currency_to, currency_from, weight_reverse)
-        edge_rates[(currency_to, currency_from)] = 1 / exchange_rate
+        update_market(graph, edge_rates, market_pair, quotes[market_pair]['rate'])
 
     return graph, edge_rates
 
 
+def update_market(graph, edge_rates, market_pair, exchange_rate):
+    """
+    Set the edges and rates of a market in both directions, in place.
+
+    Args:
+        graph: The graph object containing currency pairs and their weights.
+        edge_rates: A dictionary of exchange rates for currency pairs.
+        market_pair: (currency_from, currency_to) quoted.
+        exchange_rate: Units of currency_to per currency_from.
+    """
+    currency_from, currency_to = market_pair
+    if edge_rates.get(market_pair) == exchange_rate:
+        return  # same rate again, nothing to recompute
+    graph.add_edge(currency_from, currency_to, -math.log(exchange_rate))
+    edge_rates[(currency_from, currency_to)] = exchange_rate
+
+    graph.add_edge(currency_to, currency_from, math.log(exchange_rate))
+    edge_rates[(currency_to, currency_from)] = 1 / exchange_rate
+
+
+def remove_market(graph, edge_rates, market_pair, quotes=None):
+    """
+    Remove the edges and rates of a market in both directions. The opposite market
+    (currency_to, currency_from) sets the same two edges, so if it still has a live quote
+    the edges are set back from that quote instead.
+
+    Args:
+        graph: The graph object containing currency pairs and their weights.
+        edge_rates: A dictionary of exchange rates for currency pairs.
+        market_pair: (currency_from, currency_to) whose quote expired.
+        quotes: If given, the live quotes, which no longer include market_pair.
+    """
+    opposite = market_pair[::-1]
+    if quotes is not None and opposite in quotes:
+        update_market(graph, edge_rates, opposite, quotes[opposite]['rate'])
+        return
+    for edge in (market_pair, opposite):
+        if edge in edge_rates:
+            graph.remove_edge(*edge)
+            del edge_rates[edge]
+
+
+def find_negative_cycles(graph):
+    """
+    Find arbitrage opportunities with BellmanFord.negative_cycles: a Bellman-Ford run from a
+    virtual source connected to every currency, so cycles are found wherever they are in the
+    graph, then runs from the currencies on each cycle found. Not every negative cycle is found,
+    and the best one may be missed.
+
+    Args:
+        graph: The graph object containing currency pairs and their weights.
+
+    Returns:
+        list: The negative cycles found, the most profitable of them first, each a list of currencies that starts
+        and ends with the same one (USD if the cycle goes through it).
+    """
+    return [start_at_usd(cycle) for cycle, weight in graph.negative_cycles()]
+
+
+def scan_negative_cycles(graph, executor, workers, totals):
+    """
+    Find arbitrage opportunities with arbitrage_scan.scan, which runs Bellman-Ford from every
+    currency, split across the worker processes of executor.
+
+    Args:
+        graph: The graph object containing currency pairs and their weights.
+        executor: ProcessPoolExecutor to scan in.
+        workers: Its number of worker processes.
+        totals: Detector metrics (see add_detector_metrics); the scan's run, time, and the
+            passes and relaxations of all its workers' Bellman-Ford runs are added.
+
+    Returns:
+        list: The distinct negative cycles found, most profitable first, as find_negative_cycles.
+    """
+    started = time.perf_counter()
+    cycles = arbitrage_scan.scan(graph, executor, 'sources', workers, totals=totals) if graph.vertices else []
+    totals['runs'] += 1
+    totals['seconds'] += time.perf_counter() - started
+    return [start_at_usd(cycle) for cycle, weight in cycles]
+
+
+def start_at_usd(cycle):
+    """
+    Rotate a cycle [c0, c1, ..., c0] to start (and end) at USD, if it goes through USD.
+    """
+    cycle = cycle[:-1]
+    if 'USD' in cycle:
+        usd = cycle.index('USD')
+        cycle = cycle[usd:] + cycle[:usd]
+    return cycle + [cycle[0]]
+
+
 def find_negative_cycle(graph):
     """
-    Run the Bellman-Ford algorithm to detect negative cycles in the graph.
+    Find the most profitable of the negative cycles find_negative_cycles finds.
 
     Args:
         graph: The graph object containing currency pairs and their weights.
@@ -137,26 +242,35 @@ def find_negative_cycle(graph):
     Returns:
         list: A list of currencies forming a negative cycle, or None if no cycle exists.
     """
-    vertices = graph.vertices
-    if not vertices:
-        return None
-
-    start_vertex = next(iter(vertices))
-    distances, predecessors, negative_cycle_edge = graph.shortest_paths(start_vertex)
-
-    if negative_cycle_edge:
-        cycle = []
-        u, v = negative_cycle_edge
-        cycle.append(v)
-        current = u
-        while current not in cycle:
-            cycle.append(current)
-            current = predecessors[current]
-        cycle.append(current)
-        cycle.reverse()
-        return cycle
-    else:
-        return None
+    cycles = find_negative_cycles(graph)
+    return cycles[0] if cycles else None
+
+
+def add_detector_metrics(totals, graph):
+    """
+    Add the instrumentation of the latest Bellman-Ford run on graph to totals. The graph lives
+    for the whole run, so its own metrics() are running totals already; only its last_run is new.
+
+    Args:
+        totals: dict of 'runs', 'passes', 'relaxations' and 'seconds' so far, updated in place.
+        graph: The graph find_negative_cycles just ran on.
+    """
+    last_run = graph.last_run
+    if last_run is None:
+        return
+    totals['runs'] += 1
+    for key in ('passes', 'relaxations', 'seconds'):
+        totals[key] += last_run[key]
+
+
+def format_detector_metrics(totals):
+    """
+    One line about where the arbitrage detector spent its time.
+    """
+    runs = totals['runs'] or 1
+    return (f"Arbitrage detection: {totals['runs']} runs, {totals['passes'] / runs:.1f} passes and "
+            f"{totals['relaxations'] / runs:.1f} relaxations per run, "
+            f"{totals['seconds'] * 1000:.1f} ms in all ({totals['seconds'] * 1000 / runs:.3f} ms per run)")
 
 
 def report_arbitrage_opportunity(cycle, edge_rates):
@@ -169,8 +283,8 @@ def report_arbitrage_opportunity(cycle, edge_rates):
     """
     log = []
     log.append("ARBITRAGE:")
-    initial_amount = 100.0  # Starting with USD 100
-    current_currency = "USD"
+    initial_amount = 100.0  # Starting with 100 of the first currency, USD where the cycle goes through it
+    current_currency = cycle[0]
     log.append(f'\tStart with {current_currency} {initial_amount}')
 
     for i in range(len(cycle) - 1):
@@ -185,22 +299,21 @@ def report_arbitrage_opportunity(cycle, edge_rates):
         log.append(f'\tExchange {current_currency} for {next_currency} at {rate} --> {next_currency} {initial_amount}')
         current_currency = next_currency
 
-    # Convert back to USD if the last currency is not USD
-    if current_currency != "USD":
-        rate = edge_rates.get((current_currency, "USD"))
-        if rate is None:
-            log.append(f'No exchange rate available to convert {current_currency} back to USD.')
-            return log
-        initial_amount *= rate
-        log.append(f'\tExchange {current_currency} for USD at {rate} --> USD {initial_amount}')
-    else:
-        log.append(f'Final amount in USD: {initial_amount}')
+    log.append(f'Final amount in {current_currency}: {initial_amount}')
 
     if initial_amount > 100:
         print("\n".join(log))
 
 
-def main():
+def main(scan_workers=None):
+    """
+    Subscribe and report arbitrage for the subscription period.
+
+    Args:
+        scan_workers: If given, scan for arbitrage from every currency across this many processes
+            (arbitrage_scan.py) instead of with one virtual-source run in this process.
+    """
+    executor = ProcessPoolExecutor(max_workers=scan_workers) if scan_workers else None
     # Create a UDP socket
     with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
         sock.bind(('', 0))
@@ -216,6 +329,9 @@ def main():
         start_time = time.time()
         latest_timestamps = {}
         quotes = {}
+        graph, edge_rates = create_graph(quotes)  # kept up to date in place from here on
+        expiry_heap = []
+        detector_totals = {'runs': 0, 'passes': 0, 'relaxations': 0, 'seconds': 0.0}
 
         while True:
             elapsed_time = time.time() - start_time
@@ -226,16 +342,33 @@ def main():
             sock.settimeout(10)
             try:
                 data, address = sock.recvfrom(4096)
-                handle_message(data, latest_timestamps, quotes)
-                remove_expired_quotes(quotes)
-                graph, edge_rates = create_graph(quotes)
-                cycle = find_negative_cycle(graph)
-                if cycle:
+                handle_message(data, latest_timestamps, quotes, graph, edge_rates, expiry_heap)
+                remove_expired_quotes(quotes, graph, edge_rates, expiry_heap)
+                if executor is None:
+                    cycles = find_negative_cycles(graph)
+                    add_detector_metrics(detector_totals, graph)
+                else:
+                    cycles = scan_negative_cycles(graph, executor, scan_workers, detector_totals)
+                for cycle in cycles:  # the best found first
                     report_arbitrage_opportunity(cycle, edge_rates)
             except socket.timeout:
                 print('No messages received for 10 seconds. Exiting.')
                 break
+        print(format_detector_metrics(detector_totals))
+    if executor is not None:
+        executor.shutdown()
 
 
 if __name__ == '__main__':
-    main()
+    # python lab3.py [--scan WORKERS]
+    if '--scan' in sys.argv:
+        try:
+            scan_workers = int(sys.argv[sys.argv.index('--scan') + 1])
+        except (IndexError, ValueError):
+            scan_workers = 0
+        if scan_workers < 1:
+            print('Usage: python lab3.py [--scan WORKERS]')
+            sys.exit(1)
+        main(scan_workers=scan_workers)
+    else:
+        main()
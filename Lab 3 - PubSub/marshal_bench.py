@@ -0,0 +1,71 @@
+"""
+Forex Provider
+(c) all rights reserved
+
+Benchmark of fxp_bytes.marshal_message against the original implementation,
+which built each message by bytes concatenation with an array per field.
+Checks that both produce the same bytes for quotes with explicit times, then
+prints messages per second for a few message sizes.
+
+Usage: python marshal_bench.py [SECONDS_PER_CASE]
+"""
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import fxp_bytes
+
+
+def marshal_message_concat(quote_sequence) -> bytes:
+    """The original marshal_message, kept here for comparison."""
+    if len(quote_sequence) > fxp_bytes.MAX_QUOTES_PER_MESSAGE:
+        raise ValueError('max quotes exceeded for a single message')
+    message = bytes()
+    default_time = fxp_bytes.serialize_utcdatetime(datetime.utcnow())
+    padding = b'\x00' * 14
+    for quote in quote_sequence:
+        message += quote['cross'][0:3].encode('ascii')
+        message += quote['cross'][4:7].encode('ascii')
+        message += fxp_bytes.serialize_price(quote['price'])
+        if 'time' in quote:
+            message += fxp_bytes.serialize_utcdatetime(quote['time'])
+        else:
+            message += default_time
+        message += padding
+    return message
+
+
+def make_quotes(n, timed, rng):
+    crosses = ['GBP/USD', 'USD/JPY', 'EUR/USD', 'USD/CHF', 'AUD/USD', 'CAD/EUR', 'CAD/JPY']
+    quotes = []
+    for _ in range(n):
+        quote = {'cross': rng.choice(crosses), 'price': rng.uniform(0.5, 150.0)}
+        if timed:
+            quote['time'] = datetime(2024, 1, 1) + timedelta(microseconds=rng.randrange(10 ** 12))
+        quotes.append(quote)
+    return quotes
+
+
+def rate(fn, arg, seconds):
+    calls = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        for _ in range(100):
+            fn(arg)
+        calls += 100
+    return calls / (time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    rng = random.Random(5520)
+    for _ in range(1000):
+        quotes = make_quotes(rng.randint(0, fxp_bytes.MAX_QUOTES_PER_MESSAGE), True, rng)
+        assert fxp_bytes.marshal_message(quotes) == marshal_message_concat(quotes)
+    print('{:>7} {:>6}  {:>12} {:>12} {:>8}'.format('quotes', 'times', 'concat/s', 'struct/s', 'speedup'))
+    for n in (1, 8, 50):
+        for timed in (False, True):
+            quotes = make_quotes(n, timed, rng)
+            old, new = rate(marshal_message_concat, quotes, seconds), rate(fxp_bytes.marshal_message, quotes, seconds)
+            print('{:>7} {:>6}  {:>12,.0f} {:>12,.0f} {:>7.1f}x'.format(n, 'given' if timed else 'now', old, new, new / old))
@@ -0,0 +1,54 @@
+"""
+CPSC 5520, Seattle University
+Assignment Name: Pub/Sub Assignment
+Author: Rupeshwar Rao
+
+Microbenchmark of the subscriber's decoders: parse_message, parse_quotes and,
+if numpy is installed, parse_message_array. Prints quotes decoded per second
+for a few message sizes and the speedup over parse_message.
+
+Usage: python parse_bench.py [SECONDS_PER_CASE]
+"""
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import fxp_bytes
+import fxp_bytes_subscriber
+
+
+def make_message(n, rng):
+    crosses = ['GBP/USD', 'USD/JPY', 'EUR/USD', 'USD/CHF', 'AUD/USD', 'CAD/EUR', 'CAD/JPY']
+    return fxp_bytes.marshal_message([
+        {'cross': rng.choice(crosses), 'price': rng.uniform(0.5, 150.0),
+         'time': datetime(2024, 1, 1) + timedelta(microseconds=rng.randrange(10 ** 12))}
+        for _ in range(n)])
+
+
+def rate(fn, message, seconds):
+    """Quotes decoded per second by fn, over about seconds."""
+    calls = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        for _ in range(100):
+            fn(message)
+        calls += 100
+    return calls * (len(message) // fxp_bytes_subscriber.RECORD_SIZE) / (time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    rng = random.Random(5520)
+    decoders = [('parse_message', fxp_bytes_subscriber.parse_message),
+                ('parse_quotes', fxp_bytes_subscriber.parse_quotes)]
+    if fxp_bytes_subscriber.np is not None:
+        decoders.append(('parse_message_array', fxp_bytes_subscriber.parse_message_array))
+    for n in (1, 8, 50):
+        message = make_message(n, rng)
+        baseline = None
+        for label, decode in decoders:
+            quotes_per_second = rate(decode, message, seconds)
+            baseline = baseline or quotes_per_second
+            print('{:>3} quotes/msg  {:<20} {:>12,.0f} quotes/s  {:>5.1f}x'.format(
+                n, label, quotes_per_second, quotes_per_second / baseline))
@@ -0,0 +1,58 @@
+"""
+Forex Provider
+(c) all rights reserved
+
+Benchmark of datagram fan-out: sends one marshalled quote message to 1k and 10k
+loopback subscribers, with sendmmsg and with the sendto loop, and prints
+datagrams per second and system calls per tick.
+
+Every subscriber is a different 127.x.y.z address on the same port, so one
+receiving socket (bound to all addresses) stands in for all of them.
+
+Usage: python publish_bench.py [SECONDS_PER_CASE] [SUBSCRIBERS ...]
+"""
+import socket
+import sys
+import time
+from datetime import datetime
+
+import fxp_bytes
+from fxp_fanout import DatagramFanout, SENDMMSG
+
+
+def subscribers(n, port):
+    """n distinct loopback addresses: the last octet runs 1..254 and carries into the two above it."""
+    return [('127.{}.{}.{}'.format(1 + i // (254 * 256), i // 254 % 256, 1 + i % 254), port) for i in range(n)]
+
+
+def run(n, use_sendmmsg, seconds):
+    """
+    Publish to n subscribers for about seconds.
+
+    :return: (datagrams per second, system calls per tick)
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver, \
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        receiver.bind(('0.0.0.0', 0))
+        addresses = subscribers(n, receiver.getsockname()[1])
+        message = fxp_bytes.marshal_message([{'cross': 'GBP/USD', 'price': 1.25, 'time': datetime(2024, 1, 1)}] * 8)
+        fanout = DatagramFanout(sender, use_sendmmsg)
+        fanout.send(message, addresses)  # build the headers outside the timing
+        fanout.syscalls = 0
+        ticks = sent = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            sent += fanout.send(message, addresses)
+            ticks += 1
+        elapsed = time.perf_counter() - started
+    return sent / elapsed, fanout.syscalls / ticks
+
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    sizes = [int(arg) for arg in sys.argv[2:]] or [1000, 10000]
+    modes = [('sendto loop', False)] + ([('sendmmsg', True)] if SENDMMSG is not None else [])
+    for n in sizes:
+        for label, use_sendmmsg in modes:
+            rate, syscalls = run(n, use_sendmmsg, seconds)
+            print('{:>6} subscribers  {:<12} {:>10,.0f} datagrams/s  {:>6.0f} syscalls/tick'.format(n, label, rate, syscalls))
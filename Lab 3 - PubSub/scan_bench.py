@@ -0,0 +1,59 @@
+"""
+CPSC 5520, Seattle University
+Assignment Name: Pub/Sub Assignment
+Author: Rupeshwar Rao
+
+Wall-clock speedup of arbitrage_scan.scan against the number of worker
+processes. The graph is bellman_bench's forex-like graph with every rate
+jiggled by up to NOISE, so it is full of arbitrage cycles. One worker runs the
+scan in this process; more run it in a ProcessPoolExecutor that is started
+(and warmed up) before timing. Prints seconds per scan, the speedup over one
+worker and the distinct cycles found, for both scan modes.
+
+Usage: python scan_bench.py [CURRENCIES] [WORKERS ...]
+       CURRENCIES defaults to 100, WORKERS to 1 2 4 and the number of CPUs
+"""
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import arbitrage_scan
+from bellman_bench import make_graph
+
+NOISE = 0.002
+
+
+def make_arbitrage_graph(n, rng):
+    graph = make_graph(n, rng)
+    for u in graph.edges:
+        for v, w in list(graph.edges[u].items()):
+            graph.add_edge(u, v, w - math.log(1 + rng.uniform(-NOISE, NOISE)))
+    return graph
+
+
+def timed_scan(graph, mode, workers, executor):
+    started = time.perf_counter()
+    cycles = arbitrage_scan.scan(graph, executor, mode, workers)
+    return time.perf_counter() - started, cycles
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    counts = [int(arg) for arg in sys.argv[2:]] or sorted({1, 2, 4, os.cpu_count() or 1})
+    graph = make_arbitrage_graph(n, random.Random(5520))
+    print('{} currencies, {} CPUs'.format(n, os.cpu_count()))
+    print('{:<11} {:>7} {:>10} {:>8} {:>7}'.format('mode', 'workers', 'seconds', 'speedup', 'cycles'))
+    for mode in ('sources', 'components'):
+        base = None
+        for workers in counts:
+            if workers == 1:
+                seconds, cycles = timed_scan(graph, mode, 1, None)
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    timed_scan(graph, mode, workers, executor)  # start the workers
+                    seconds, cycles = timed_scan(graph, mode, workers, executor)
+            base = base or seconds
+            print('{:<11} {:>7} {:>10.3f} {:>7.2f}x {:>7}'.format(mode, workers, seconds, base / seconds, len(cycles)))